@@ -0,0 +1 @@
+bash ./scripts/bench --config configs/bench_mnist.yaml
@@ -1,4 +1,4 @@
 from . import callbacks, datamodules, models
-from .utils import loggers
+from .utils import loggers, profilers
 
-__all__ = ["callbacks", "datamodules", "models", "loggers"]
+__all__ = ["callbacks", "datamodules", "models", "loggers", "profilers"]
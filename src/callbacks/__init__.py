@@ -1,3 +1,19 @@
+from .approx_validation import ApproxValidation
+from .async_checkpoint import AsyncCheckpoint
+from .benchmark import Benchmark
+from .loader_tuner import LoaderTuner
 from .metric import Metric
+from .phase_timer import PhaseTimer
+from .prediction_writer import PredictionWriter
+from .tune_report import TuneReport
 
-__all__ = ["Metric"]
+__all__ = [
+    "ApproxValidation",
+    "AsyncCheckpoint",
+    "Benchmark",
+    "LoaderTuner",
+    "Metric",
+    "PhaseTimer",
+    "PredictionWriter",
+    "TuneReport",
+]
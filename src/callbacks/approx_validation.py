@@ -0,0 +1,244 @@
+import math
+import time
+from collections.abc import Iterator
+
+import lightning as L
+import torch
+from lightning.pytorch.callbacks import EarlyStopping, ModelCheckpoint
+from lightning.pytorch.trainer.states import TrainerFn
+from lightning.pytorch.utilities.data import _update_dataloader, has_iterable_dataset
+from torch.utils.data import DataLoader, Dataset, Sampler, Subset
+
+
+def _labels(dataset: Dataset) -> torch.Tensor | None:
+    # labels of the map-style datasets of this project, `None` if unknown
+    if isinstance(dataset, Subset):
+        labels = _labels(dataset.dataset)
+        return None if labels is None else labels[torch.as_tensor(dataset.indices)]
+    if hasattr(dataset, "targets"):
+        return torch.as_tensor(dataset.targets)
+    if "labels" in getattr(dataset, "column_names", []):
+        return torch.as_tensor(dataset.with_format("numpy")["labels"])
+    # wrappers of the same length, e.g., the task datasets of multi-task training
+    inner = getattr(dataset, "dataset", None)
+    if isinstance(inner, Dataset) and len(inner) == len(dataset):
+        return _labels(inner)
+    return None
+
+
+def _stratified_order(
+    labels: torch.Tensor | None, size: int, generator: torch.Generator
+) -> torch.Tensor:
+    # A permutation whose every prefix holds the classes in proportion: each
+    # example is keyed by its (shuffled) rank within its class divided by the
+    # class size, with a random offset per class to break ties.
+    if labels is None:
+        return torch.randperm(size, generator=generator)
+    if labels.is_floating_point():
+        # regression targets are stratified by deciles
+        labels = labels.double()
+        labels = torch.bucketize(
+            labels, torch.quantile(labels, torch.linspace(0.1, 0.9, 9).double())
+        )
+
+    keys = torch.empty(size, dtype=torch.float64)
+    for label in labels.unique():
+        indices = (labels == label).nonzero().squeeze(1)
+        indices = indices[torch.randperm(len(indices), generator=generator)]
+        offset = torch.rand(1, generator=generator, dtype=torch.float64)
+        keys[indices] = (torch.arange(len(indices)) + offset) / len(indices)
+
+    return torch.argsort(keys, stable=True)
+
+
+class _SubsetSampler(Sampler[int]):
+    # Yields `indices` in order, until `time_budget` seconds since the start of the
+    # iteration have passed.
+    def __init__(self, indices: list[int], time_budget: float | None = None):
+        self.indices = indices
+        self.time_budget = time_budget
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __iter__(self) -> Iterator[int]:
+        deadline = time.monotonic() + (self.time_budget or math.inf)
+        for i, index in enumerate(self.indices):
+            if i and time.monotonic() > deadline:
+                return
+            yield index
+
+
+class ApproxValidation(L.Callback):
+    r"""
+    Validate on a fixed subset of each validation set during fitting, and on the
+    full sets every ``full_every_n_epochs`` epochs and in the last epoch.
+
+    The subset is stratified by label (by deciles for regression) and seeded
+    independently of the run, so approximate validations of all epochs and runs
+    see the same examples and compare with each other. Their metrics are logged
+    under ``val_approx/`` instead of ``val/``, e.g., ``val_approx/acc``.
+    ``ModelCheckpoint`` and ``EarlyStopping`` skip the validations of the other
+    kind than the key they monitor, i.e., a ``val/`` monitor selects among the
+    full validations and a ``val_approx/`` monitor among the approximate ones,
+    ``save_last`` included.
+
+    The examples of the subset are ordered such that any prefix is stratified
+    too, which lets ``time_budget`` end an approximate validation early. The
+    budget is split evenly across the validation dataloaders, e.g., MNLI matched
+    and mismatched.
+
+    ``Metric`` validates the best checkpoint on the full sets after fitting if an
+    approximate validation selected it, so the saved validation metrics are
+    always exact. Iterable (streaming) validation sets are validated in full.
+
+    Args:
+        num_samples: Size of the subset of each validation set, a fraction if
+            ``float`` or a number of examples if ``int``.
+        full_every_n_epochs: Validate on the full sets every n epochs, only in
+            the last epoch if ``None``. Keep it a multiple of the trainer's
+            ``check_val_every_n_epoch``.
+        time_budget: Seconds an approximate validation may take, single device
+            only.
+        seed: Seed of the subset.
+    """
+
+    PREFIX = "val_approx/"
+
+    def __init__(
+        self,
+        num_samples: int | float = 0.1,
+        full_every_n_epochs: int | None = 5,
+        time_budget: float | None = None,
+        seed: int = 0,
+    ):
+        self.num_samples = num_samples
+        self.full_every_n_epochs = full_every_n_epochs
+        self.time_budget = time_budget
+        self.seed = seed
+        # whether the current validation dataloaders are approximate
+        self.approximate = False
+        self._orders = {}
+        self._monitors = []
+
+    def setup(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, stage: str
+    ) -> None:
+        if stage != TrainerFn.FITTING:
+            return
+        if self.time_budget is not None and trainer.world_size > 1:
+            raise ValueError(
+                "`time_budget` would end validation at different steps on each"
+                " device, it is supported on a single device only."
+            )
+
+        datamodule = trainer.datamodule
+        val_dataloader = datamodule.val_dataloader
+
+        def approx_val_dataloader():
+            dataloaders = val_dataloader()
+            if trainer.state.fn != TrainerFn.FITTING or not self.approximate:
+                return dataloaders
+            if isinstance(dataloaders, DataLoader):
+                return self._subset(dataloaders, 0, 1)
+            return [
+                self._subset(x, i, len(dataloaders)) for i, x in enumerate(dataloaders)
+            ]
+
+        datamodule.val_dataloader = approx_val_dataloader
+
+        log = pl_module.log
+
+        def approx_log(name: str, *args, **kwargs):
+            # `log_dict` logs through `log` too
+            if (
+                self.approximate
+                and trainer.state.fn == TrainerFn.FITTING
+                and (trainer.validating or trainer.sanity_checking)
+                and name.startswith("val/")
+            ):
+                name = self.PREFIX + name.removeprefix("val/")
+            return log(name, *args, **kwargs)
+
+        pl_module.log = approx_log
+
+        self._monitors = [
+            x
+            for x in trainer.callbacks
+            if isinstance(x, ModelCheckpoint | EarlyStopping)
+        ]
+        for monitor in self._monitors:
+            for hook in ["on_train_epoch_end", "on_validation_end"]:
+                setattr(monitor, hook, self._skip_other_kind(monitor, hook))
+
+        self.approximate = not self._is_full(trainer)
+
+    def on_train_epoch_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        approximate = not self._is_full(trainer)
+        if approximate != self.approximate:
+            self.approximate = approximate
+            # the validation loop requests its dataloaders again when they are unset
+            trainer.fit_loop.epoch_loop.val_loop._combined_loader = None
+
+    def teardown(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        stage: str,
+    ) -> None:
+        if stage != TrainerFn.FITTING:
+            return
+
+        # drop the instance attributes to restore the methods
+        trainer.datamodule.__dict__.pop("val_dataloader", None)
+        pl_module.__dict__.pop("log", None)
+        for monitor in self._monitors:
+            monitor.__dict__.pop("on_train_epoch_end", None)
+            monitor.__dict__.pop("on_validation_end", None)
+        self.approximate = False
+        self._orders = {}
+        self._monitors = []
+
+    def _skip_other_kind(self, monitor: L.Callback, hook: str):
+        method = getattr(monitor, hook)
+
+        def skip_other_kind(trainer: L.Trainer, pl_module: L.LightningModule):
+            # the key of the other kind may hold a value of an earlier epoch
+            key = monitor.monitor
+            if key is not None and key.startswith(self.PREFIX) != self.approximate:
+                return
+            return method(trainer, pl_module)
+
+        return skip_other_kind
+
+    def _is_full(self, trainer: L.Trainer) -> bool:
+        epoch = trainer.current_epoch + 1
+        if self.full_every_n_epochs and epoch % self.full_every_n_epochs == 0:
+            return True
+        max_epochs = trainer.max_epochs
+        return max_epochs is not None and max_epochs > 0 and epoch >= max_epochs
+
+    def _subset(
+        self, dataloader: DataLoader, index: int, num_dataloaders: int
+    ) -> DataLoader:
+        if has_iterable_dataset(dataloader):
+            return dataloader
+
+        dataset = dataloader.dataset
+        if index not in self._orders:
+            generator = torch.Generator().manual_seed(self.seed)
+            self._orders[index] = _stratified_order(
+                _labels(dataset), len(dataset), generator
+            )
+        order = self._orders[index]
+
+        if isinstance(self.num_samples, float):
+            num_samples = math.ceil(self.num_samples * len(order))
+        else:
+            num_samples = self.num_samples
+        time_budget = self.time_budget and self.time_budget / num_dataloaders
+        sampler = _SubsetSampler(order[:num_samples].tolist(), time_budget)
+
+        return _update_dataloader(dataloader, sampler)
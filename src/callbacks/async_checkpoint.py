@@ -0,0 +1,172 @@
+import os
+from collections.abc import Callable
+from weakref import proxy
+
+import lightning as L
+import torch
+from lightning.fabric.utilities.types import _PATH
+from lightning.pytorch.callbacks import ModelCheckpoint
+from lightning.pytorch.plugins.io import AsyncCheckpointIO
+from lightning_utilities.core.apply_func import apply_to_collection
+
+SAFETENSORS_EXTENSION = ".safetensors"
+
+
+def _snapshot(checkpoint):
+    # copy to host memory on the training thread, the weights and optimizer state
+    # change with the next step while the copy is written
+    return apply_to_collection(
+        checkpoint, torch.Tensor, lambda t: t.detach().to("cpu", copy=True)
+    )
+
+
+def save_weights(state_dict: dict[str, torch.Tensor], path: _PATH) -> None:
+    r"""Save ``state_dict`` to a safetensors file, atomically."""
+    from safetensors.torch import save_file
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    save_file({k: v.contiguous() for k, v in state_dict.items()}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_weights(module: L.LightningModule, path: _PATH) -> None:
+    r"""Load the weights of a safetensors file saved by ``AsyncCheckpoint``."""
+    from safetensors.torch import load_file
+
+    device = next(module.parameters(), torch.empty(0)).device
+    checkpoint = {"state_dict": load_file(path, device=str(device))}
+    module.on_load_checkpoint(checkpoint)
+    module.load_state_dict(checkpoint["state_dict"])
+
+
+class _AsyncCheckpointIO(AsyncCheckpointIO):
+    # Lightning's `AsyncCheckpointIO` clones on the device and removes checkpoints
+    # right away. Here the snapshot goes to host memory, at most one write is in
+    # flight and removals run after the pending writes.
+    def __init__(self, checkpoint_io=None):
+        super().__init__(checkpoint_io)
+        self._future = None
+
+    def submit(self, fn: Callable, *args) -> None:
+        self._ensure_setup()
+        self.wait()
+
+        def run():
+            try:
+                fn(*args)
+            except BaseException as e:
+                self._error = e
+
+        self._future = self._executor.submit(run)
+
+    def wait(self) -> None:
+        if self._future is not None:
+            self._future.result()
+            self._future = None
+        if self._error:
+            raise self._error
+
+    def save_checkpoint(self, checkpoint, path, storage_options=None) -> None:
+        checkpoint = _snapshot(checkpoint)
+        self.submit(
+            self.checkpoint_io.save_checkpoint, checkpoint, path, storage_options
+        )
+
+    def remove_checkpoint(self, path) -> None:
+        self.submit(self.checkpoint_io.remove_checkpoint, path)
+
+    def load_checkpoint(self, *args, **kwargs):
+        self.wait()
+        return self.checkpoint_io.load_checkpoint(*args, **kwargs)
+
+    def teardown(self) -> None:
+        self._future = None
+        super().teardown()
+
+
+class AsyncCheckpoint(ModelCheckpoint):
+    r"""
+    ``ModelCheckpoint`` that writes checkpoints on a background thread and
+    optionally keeps the top-k checkpoints as weights-only safetensors.
+
+    With ``async_save``, the state is copied to host memory on the training
+    thread, then a single background thread writes it and removes outdated
+    checkpoints in order. At most one write is in flight, so a save only blocks
+    while the previous one is still being written, and at most ``save_top_k``
+    (plus the last) checkpoints are kept on disk. Pending writes are flushed when
+    the strategy is torn down, before ``Metric`` evaluates the best checkpoint.
+
+    With ``safetensors``, the top-k checkpoints hold the weights of the model
+    only, as ``.safetensors`` files that ``Metric`` loads after fitting (and
+    ``load_weights`` elsewhere). The ``save_last`` checkpoint remains a full
+    ``.ckpt`` to resume from.
+
+    Args:
+        async_save: Write checkpoints on a background thread.
+        safetensors: Save the top-k checkpoints as weights-only safetensors.
+        **kwargs: Arguments of ``ModelCheckpoint``.
+    """
+
+    def __init__(self, async_save: bool = True, safetensors: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        if safetensors and self.save_last == "link":
+            raise ValueError(
+                "`save_last='link'` would link to weights-only safetensors, use"
+                " `save_last=True` to resume."
+            )
+
+        self.async_save = async_save
+        self.safetensors = safetensors
+
+    def setup(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, stage: str
+    ) -> None:
+        super().setup(trainer, pl_module, stage)
+        strategy = trainer.strategy
+        if self.async_save and not isinstance(
+            strategy.checkpoint_io, _AsyncCheckpointIO
+        ):
+            # torn down (and flushed) with the strategy at the end of every run
+            strategy.checkpoint_io = _AsyncCheckpointIO(strategy.checkpoint_io)
+
+    def format_checkpoint_name(
+        self,
+        metrics: dict[str, torch.Tensor],
+        filename: str | None = None,
+        ver: int | None = None,
+        prefix: str | None = None,
+    ) -> str:
+        filepath = super().format_checkpoint_name(metrics, filename, ver, prefix)
+        if self.safetensors and filename != self.CHECKPOINT_NAME_LAST:
+            filepath = (
+                filepath.removesuffix(self.FILE_EXTENSION) + SAFETENSORS_EXTENSION
+            )
+
+        return filepath
+
+    def _save_checkpoint(self, trainer: L.Trainer, filepath: str) -> None:
+        if not filepath.endswith(SAFETENSORS_EXTENSION):
+            return super()._save_checkpoint(trainer, filepath)
+
+        if trainer.is_global_zero:
+            # the module may trim its weights as for full checkpoints, e.g., to the
+            # trained LoRA delta
+            pl_module = trainer.lightning_module
+            checkpoint = {"state_dict": pl_module.state_dict()}
+            pl_module.on_save_checkpoint(checkpoint)
+            # the snapshot also unties shared weights, which safetensors rejects
+            state_dict = _snapshot(checkpoint["state_dict"])
+            checkpoint_io = trainer.strategy.checkpoint_io
+            if isinstance(checkpoint_io, _AsyncCheckpointIO):
+                checkpoint_io.submit(save_weights, state_dict, filepath)
+            else:
+                save_weights(state_dict, filepath)
+        trainer.strategy.barrier("AsyncCheckpoint._save_checkpoint")
+
+        # as in `ModelCheckpoint._save_checkpoint`
+        self._last_global_step_saved = trainer.global_step
+        self._last_checkpoint_saved = filepath
+        if trainer.is_global_zero:
+            for logger in trainer.loggers:
+                logger.after_save_checkpoint(proxy(self))
@@ -0,0 +1,165 @@
+import json
+import resource
+import time
+from pathlib import Path
+
+import lightning as L
+import torch
+from lightning.pytorch.trainer.states import TrainerFn
+from lightning.pytorch.utilities import rank_zero_only
+from lightning.pytorch.utilities.data import extract_batch_size
+
+from ..utils.compile import compile_time
+
+
+class Benchmark(L.Callback):
+    r"""
+    Measure loader and training step throughput and save it to
+    ``Trainer.log_dir/bench.json``.
+
+    Time to first batch is counted from the instantiation of the callback, i.e.,
+    it includes model loading, data preparation and dataloader startup. The time
+    spent by ``torch.compile`` is reported separately as ``compile_time``, step
+    latencies exclude the warmup steps where compilation usually happens.
+
+    Step latencies are split into the forward (from the start of the batch to
+    ``backward``) and the backward, the rest of the step is the optimizer step
+    and the hooks. The device is synchronized at the split on CUDA, otherwise
+    the backward would include the queued forward kernels.
+
+    Args:
+        warmup_steps: Number of training steps excluded from the step latencies.
+        num_loader_batches: Number of batches to fetch for the loader-only pass.
+    """
+
+    def __init__(self, warmup_steps: int = 5, num_loader_batches: int = 50):
+        self.warmup_steps = warmup_steps
+        self.num_loader_batches = num_loader_batches
+
+        self._start_time = time.perf_counter()
+        self._time_to_first_batch = None
+        self._step_start = None
+        self._step_latencies = []
+        self._step_samples = 0
+        # time of the last split of the step into forward and backward
+        self._split_time = None
+        self._forward_latency = self._backward_latency = 0.0
+        self._forward_latencies = []
+        self._backward_latencies = []
+
+    def on_train_batch_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, batch, batch_idx: int
+    ) -> None:
+        if self._time_to_first_batch is None:
+            self._time_to_first_batch = time.perf_counter() - self._start_time
+        self._step_start = self._split_time = time.perf_counter()
+        self._forward_latency = self._backward_latency = 0.0
+
+    def on_before_backward(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, loss: torch.Tensor
+    ) -> None:
+        self._forward_latency += self._split(pl_module)
+
+    def on_after_backward(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        self._backward_latency += self._split(pl_module)
+
+    def _split(self, pl_module: L.LightningModule) -> float:
+        if pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        split_time = time.perf_counter()
+        elapsed = split_time - self._split_time
+        self._split_time = split_time
+        return elapsed
+
+    def on_train_batch_end(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        outputs,
+        batch,
+        batch_idx: int,
+    ) -> None:
+        latency = time.perf_counter() - self._step_start
+        if batch_idx >= self.warmup_steps:
+            self._step_latencies.append(latency)
+            self._step_samples += extract_batch_size(batch)
+            # none if the step skipped backward, e.g., a `None` loss
+            if self._backward_latency:
+                self._forward_latencies.append(self._forward_latency)
+                self._backward_latencies.append(self._backward_latency)
+
+    def teardown(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        stage: str | None = None,
+    ) -> None:
+        if stage != TrainerFn.FITTING:
+            return
+
+        metrics = {
+            "time_to_first_batch": self._time_to_first_batch,
+            "compile_time": compile_time(),
+        }
+        metrics.update(self._loader_metrics(trainer))
+
+        if self._step_latencies:
+            metrics.update(self._percentiles("step_latency", self._step_latencies))
+            metrics["step_throughput"] = self._step_samples / sum(self._step_latencies)
+        if self._forward_latencies:
+            metrics.update(
+                self._percentiles("forward_latency", self._forward_latencies)
+            )
+            metrics.update(
+                self._percentiles("backward_latency", self._backward_latencies)
+            )
+
+        # ru_maxrss is in kilobytes on Linux, children covers dataloader workers
+        metrics["peak_rss_mb"] = (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        )
+        metrics["peak_rss_children_mb"] = (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        )
+
+        self._save(trainer.log_dir, metrics)
+
+    @staticmethod
+    def _percentiles(name: str, latencies: list[float]) -> dict[str, float]:
+        latencies = torch.tensor(latencies, dtype=torch.float64)
+        quantiles = latencies.quantile(torch.tensor([0.5, 0.9, 0.99]).double())
+        return {
+            f"{name}_p50": quantiles[0].item(),
+            f"{name}_p90": quantiles[1].item(),
+            f"{name}_p99": quantiles[2].item(),
+        }
+
+    def _loader_metrics(self, trainer: L.Trainer) -> dict[str, float]:
+        if trainer.datamodule is None:
+            return {}
+
+        dataloader = trainer.datamodule.train_dataloader()
+        num_samples = 0
+        start_time = time.perf_counter()
+        for i, batch in enumerate(dataloader):
+            if i == 0:
+                first_batch_time = time.perf_counter() - start_time
+            num_samples += extract_batch_size(batch)
+            if i + 1 >= self.num_loader_batches:
+                break
+        elapsed = time.perf_counter() - start_time
+
+        return {
+            "loader_first_batch": first_batch_time,
+            "loader_throughput": num_samples / elapsed,
+        }
+
+    @rank_zero_only
+    def _save(self, log_dir: str, metrics: dict[str, float]) -> None:
+        metrics_str = json.dumps(metrics, ensure_ascii=False, indent=2)
+
+        metrics_file = Path(log_dir) / "bench.json"
+        with metrics_file.open("w") as f:
+            f.write(metrics_str)
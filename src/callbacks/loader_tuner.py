@@ -0,0 +1,233 @@
+import os
+import time
+
+import lightning as L
+import torch
+from lightning.pytorch.callbacks import BatchSizeFinder
+from lightning.pytorch.cli import SaveConfigCallback
+from lightning.pytorch.trainer.states import TrainerFn
+from lightning.pytorch.utilities import rank_zero_info
+from lightning.pytorch.utilities.data import extract_batch_size
+
+from ..utils.profilers import reset_peak_memory, resident_memory
+
+
+class LoaderTuner(BatchSizeFinder):
+    r"""
+    Tune ``batch_size``, ``num_workers`` and ``pin_memory`` of the datamodule at
+    the start of fitting and save them to the ``config.yaml`` of the run.
+
+    The batch size is scaled by ``BatchSizeFinder`` until a training step, i.e.,
+    forward, backward and optimizer step (of the last accumulated batch with
+    gradient accumulation), exceeds the memory budget: peak
+    allocated memory on GPUs, peak resident memory of the process on CPUs (the
+    resident memory at the end of the step where the peak cannot be reset, i.e.,
+    outside Linux). Then the loader throughput is probed for each number of
+    workers at the tuned batch size, and the smallest number within
+    ``tolerance`` of the best throughput is kept, so that nodes are neither
+    starved nor oversubscribed. Memory is pinned for GPU training only.
+
+    The callback removes itself from the saved config, so later runs from it reuse
+    the tuned values without tuning again.
+
+    Args:
+        memory_budget_mb: Memory budget of a training step in MB, defaults to
+            ``memory_fraction`` of the device (or physical) memory.
+        memory_fraction: Fraction of the memory used as default budget.
+        num_workers: Numbers of workers to probe, defaults to 0 and powers of 2
+            below the number of available CPUs.
+        num_loader_batches: Number of batches to fetch per number of workers.
+        tolerance: Relative throughput loss accepted for fewer workers.
+        mode: Search mode of ``BatchSizeFinder``, ``power`` or ``binsearch``.
+        steps_per_trial: Number of training steps per batch size.
+        init_val: Initial batch size.
+        max_trials: Maximum number of batch size increases.
+        max_val: Maximum batch size.
+    """
+
+    def __init__(
+        self,
+        memory_budget_mb: float | None = None,
+        memory_fraction: float = 0.8,
+        num_workers: list[int] | None = None,
+        num_loader_batches: int = 20,
+        tolerance: float = 0.05,
+        mode: str = "power",
+        steps_per_trial: int = 3,
+        init_val: int = 2,
+        max_trials: int = 25,
+        max_val: int = 8192,
+    ):
+        super().__init__(
+            mode=mode,
+            steps_per_trial=steps_per_trial,
+            init_val=init_val,
+            max_trials=max_trials,
+            max_val=max_val,
+        )
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_fraction = memory_fraction
+        self.num_workers = num_workers
+        self.num_loader_batches = num_loader_batches
+        self.tolerance = tolerance
+
+    def on_fit_start(self, trainer: L.Trainer, pl_module: L.LightningModule) -> None:
+        if trainer.fast_dev_run:
+            # warns and skips
+            return super().on_fit_start(trainer, pl_module)
+
+        device = trainer.strategy.root_device
+        budget = self.memory_budget_mb or self.memory_fraction * _total_memory(device)
+        if _memory_used(device) > budget:
+            raise ValueError(
+                f"{_memory_used(device):.0f} MB are used before training, more than"
+                f" the memory budget of {budget:.0f} MB."
+            )
+
+        # `BatchSizeFinder` runs without callbacks, the closure of the optimizer step
+        # runs the forward and backward
+        strategy = trainer.strategy
+        optimizer_step = strategy.optimizer_step
+
+        def budgeted_optimizer_step(*args, **kwargs):
+            # the peak of this step only, not of earlier larger batch sizes
+            if device.type == "cuda":
+                torch.cuda.reset_peak_memory_stats(device)
+                peak = True
+            else:
+                peak = reset_peak_memory()
+            output = optimizer_step(*args, **kwargs)
+            memory = _memory_used(device, peak=peak)
+            if memory > budget:
+                # the message is what `BatchSizeFinder` recognizes as out of memory
+                raise RuntimeError(
+                    "DefaultCPUAllocator: can't allocate memory:"
+                    f" {memory:.0f} MB exceeds the budget of {budget:.0f} MB"
+                )
+            return output
+
+        strategy.optimizer_step = budgeted_optimizer_step
+        try:
+            super().on_fit_start(trainer, pl_module)
+        finally:
+            # drop the instance attribute to restore the strategy method
+            strategy.__dict__.pop("optimizer_step", None)
+
+        datamodule = trainer.datamodule
+        hparams = datamodule.hparams
+        if "pin_memory" in hparams:
+            hparams.pin_memory = device.type == "cuda"
+        if "num_workers" in hparams:
+            hparams.num_workers = self._tune_num_workers(datamodule)
+        _reload_dataloaders(trainer)
+
+        values = {
+            "batch_size": self.optimal_batch_size,
+            **{k: hparams[k] for k in ["num_workers", "pin_memory"] if k in hparams},
+        }
+        rank_zero_info(f"Tuned the loader to {values}.")
+        self._save_config(trainer, pl_module, values)
+
+    def on_validation_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        # only tune for fitting
+        pass
+
+    def on_test_start(self, trainer: L.Trainer, pl_module: L.LightningModule) -> None:
+        pass
+
+    def on_predict_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        pass
+
+    def _tune_num_workers(self, datamodule: L.LightningDataModule) -> int:
+        candidates = self.num_workers
+        if candidates is None:
+            num_cpus = len(os.sched_getaffinity(0))
+            candidates = [0] + [
+                2**i for i in range(num_cpus.bit_length()) if 2**i < num_cpus
+            ]
+
+        throughputs = {}
+        for num_workers in candidates:
+            datamodule.hparams.num_workers = num_workers
+            throughputs[num_workers] = self._loader_throughput(
+                datamodule.train_dataloader()
+            )
+            rank_zero_info(
+                f"Loader throughput with {num_workers} workers:"
+                f" {throughputs[num_workers]:.1f} samples/s"
+            )
+
+        best = max(throughputs.values())
+        return min(
+            k for k, v in throughputs.items() if v >= (1 - self.tolerance) * best
+        )
+
+    def _loader_throughput(self, dataloader) -> float:
+        iterator = iter(dataloader)
+        # exclude the startup of workers
+        next(iterator, None)
+
+        num_samples = 0
+        start_time = time.perf_counter()
+        for i, batch in enumerate(iterator):
+            num_samples += extract_batch_size(batch)
+            if i + 1 >= self.num_loader_batches:
+                break
+        elapsed = time.perf_counter() - start_time
+        del iterator
+
+        return num_samples / elapsed if elapsed > 0 else 0.0
+
+    def _save_config(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, values: dict
+    ) -> None:
+        for callback in trainer.callbacks:
+            if not isinstance(callback, SaveConfigCallback):
+                continue
+
+            config = callback.config
+            data = config.data.init_args if "init_args" in config.data else config.data
+            for k, v in values.items():
+                if k in data:
+                    data[k] = v
+
+            callbacks = config.trainer.callbacks or []
+            config.trainer.callbacks = [
+                x
+                for x in callbacks
+                if x.class_path.rsplit(".", 1)[-1] != type(self).__name__
+            ]
+
+            # the config was saved in `setup` already
+            callback.already_saved = False
+            callback.setup(trainer, pl_module, TrainerFn.FITTING)
+
+
+def _total_memory(device: torch.device) -> float:
+    if device.type == "cuda":
+        return torch.cuda.get_device_properties(device).total_memory / 2**20
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20
+
+
+def _memory_used(device: torch.device, peak: bool = False) -> float:
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    rss, hwm = resident_memory()
+    return hwm if peak else rss
+
+
+def _reload_dataloaders(trainer: L.Trainer) -> None:
+    # The only private Lightning API used here, which `BatchSizeFinder` relies on
+    # too: the loops build their dataloaders once per run.
+    try:
+        from lightning.pytorch.tuner.batch_size_scaling import _reset_dataloaders
+    except ImportError as e:
+        raise RuntimeError(
+            f"`LoaderTuner` does not support lightning {L.__version__}, which moved"
+            " `_reset_dataloaders`."
+        ) from e
+    _reset_dataloaders(trainer)
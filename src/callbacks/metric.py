@@ -1,17 +1,77 @@
 import json
 import logging
+import math
 from pathlib import Path
 
 import lightning as L
 from lightning.fabric.utilities.apply_func import convert_tensors_to_scalars
 from lightning.pytorch.trainer.states import TrainerFn
 
+from .approx_validation import ApproxValidation
+from .async_checkpoint import SAFETENSORS_EXTENSION, load_weights
+
 
 class Metric(L.Callback):
     r"""
     Save logged metrics to ``Trainer.log_dir``.
+
+    After fitting, the validation metrics of the best checkpoint are reused from
+    the validation run that produced it (unless ``ApproxValidation`` validated on
+    a subset), so only the test set is evaluated and the checkpoint is not
+    reloaded if it matches the in-memory weights.
     """
 
+    def __init__(self):
+        self._best_model_path = ""
+        self._best_val_metrics = None
+        self._best_step = None
+        self._last_val_metrics = None
+        self._last_val_step = None
+
+    def _update_best(self, trainer: L.Trainer) -> None:
+        # `ModelCheckpoint` runs after the other callbacks, so a new best path means
+        # the last recorded validation produced it.
+        ckpt_callback = trainer.checkpoint_callback
+        if ckpt_callback.best_model_path == self._best_model_path:
+            return
+
+        self._best_model_path = ckpt_callback.best_model_path
+        self._best_val_metrics = self._last_val_metrics
+        self._best_step = self._last_val_step
+
+        monitor, score = ckpt_callback.monitor, ckpt_callback.best_model_score
+        if (
+            self._best_val_metrics is None
+            or monitor not in self._best_val_metrics
+            or score is None
+            or not math.isclose(
+                self._best_val_metrics[monitor], score.item(), rel_tol=1e-6
+            )
+        ):
+            self._best_val_metrics = None
+            self._best_step = None
+
+    def on_validation_end(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        if trainer.state.fn != TrainerFn.FITTING or trainer.sanity_checking:
+            return
+
+        if trainer.checkpoint_callback:
+            self._update_best(trainer)
+
+        self._last_val_metrics = {
+            k: v
+            for k, v in convert_tensors_to_scalars(trainer.logged_metrics).items()
+            if k.startswith("val/")
+        }
+        self._last_val_step = trainer.global_step
+        if any(
+            isinstance(x, ApproxValidation) and x.approximate for x in trainer.callbacks
+        ):
+            # not reused, the best checkpoint is validated on the full sets
+            self._last_val_metrics = None
+
     def teardown(
         self,
         trainer: L.Trainer,
@@ -24,7 +84,17 @@ class Metric(L.Callback):
                 trainer.checkpoint_callback
                 and trainer.checkpoint_callback.best_model_path
             ):
-                ckpt_path = trainer.checkpoint_callback.best_model_path
+                self._update_best(trainer)
+
+                # the in-memory weights are the best ones if nothing trained since
+                if self._best_step == trainer.global_step:
+                    ckpt_path = None
+                else:
+                    ckpt_path = trainer.checkpoint_callback.best_model_path
+                    if ckpt_path.endswith(SAFETENSORS_EXTENSION):
+                        # weights-only checkpoints of `AsyncCheckpoint`
+                        load_weights(pl_module, ckpt_path)
+                        ckpt_path = None
                 # inhibit disturbing logging
                 logging.getLogger("lightning.pytorch.utilities.distributed").setLevel(
                     logging.WARNING
@@ -36,17 +106,21 @@ class Metric(L.Callback):
                 fn_kwargs = {
                     "model": pl_module,
                     "datamodule": trainer.datamodule,
-                    "ckpt_path": ckpt_path,
                 }
 
                 val_metrics = {}
                 if trainer.validate_loop._data_source.is_defined():
-                    trainer.validate(**fn_kwargs)
-                    val_metrics = convert_tensors_to_scalars(trainer.logged_metrics)
+                    if self._best_val_metrics is not None:
+                        val_metrics = self._best_val_metrics
+                    else:
+                        trainer.validate(**fn_kwargs, ckpt_path=ckpt_path)
+                        val_metrics = convert_tensors_to_scalars(trainer.logged_metrics)
+                        # the best weights are loaded into the model now
+                        ckpt_path = None
 
                 test_metrics = {}
                 if trainer.test_loop._data_source.is_defined():
-                    trainer.test(**fn_kwargs)
+                    trainer.test(**fn_kwargs, ckpt_path=ckpt_path)
                     test_metrics = convert_tensors_to_scalars(trainer.logged_metrics)
 
                 metrics = {**val_metrics, **test_metrics}
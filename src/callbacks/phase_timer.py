@@ -0,0 +1,187 @@
+import json
+import time
+from pathlib import Path
+
+import lightning as L
+import torch
+from lightning.pytorch.utilities import rank_zero_only, rank_zero_warn
+
+from ..utils.compile import compile_time
+
+PHASES = ["data_wait", "transfer", "forward", "backward", "optimizer", "step"]
+
+
+class PhaseTimer(L.Callback):
+    r"""
+    Time the phases of each training step and save per-epoch percentiles to
+    ``Trainer.log_dir/timings.json``.
+
+    Phases are host wall times without device synchronization: ``data_wait``
+    (fetching the batch), ``transfer`` (host to device copy), ``forward``,
+    ``backward``, ``optimizer`` (step and zero grad) and the whole ``step``.
+    Only the last ``capacity`` steps of an epoch are kept in a ring buffer. The
+    time spent by ``torch.compile`` during the epoch is saved as ``compile_time``,
+    the percentiles reflect the steady state once compilation is done. The time
+    checkpoint saves block training is saved as ``checkpoint_time`` (saves at the
+    end of an epoch count towards the next one) and not counted as ``data_wait``.
+
+    Args:
+        capacity: Size of the ring buffer in steps.
+        starvation_threshold: Flag the epoch as loader-starved when the median
+            ``data_wait`` exceeds this fraction of the median ``step`` time.
+    """
+
+    def __init__(self, capacity: int = 1024, starvation_threshold: float = 0.2):
+        self.capacity = capacity
+        self.starvation_threshold = starvation_threshold
+
+        self._buffer = [[0.0] * len(PHASES) for _ in range(capacity)]
+        self._num_steps = 0
+        self._timings = []
+        self._transfer = 0.0
+        self._checkpoint_time = 0.0
+
+    def setup(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, stage: str
+    ) -> None:
+        strategy = trainer.strategy
+        batch_to_device = strategy.batch_to_device
+
+        def timed_batch_to_device(*args, **kwargs):
+            start = time.perf_counter()
+            batch = batch_to_device(*args, **kwargs)
+            self._transfer = time.perf_counter() - start
+            return batch
+
+        strategy.batch_to_device = timed_batch_to_device
+
+        for callback in trainer.checkpoint_callbacks:
+            self._time_checkpoint(callback)
+
+    def _time_checkpoint(self, callback: L.Callback) -> None:
+        save_checkpoint = callback._save_checkpoint
+
+        def timed_save_checkpoint(*args, **kwargs):
+            start = time.perf_counter()
+            save_checkpoint(*args, **kwargs)
+            end = time.perf_counter()
+            self._checkpoint_time += end - start
+            # like validation, saving between steps is not waiting for data
+            self._last_end = end
+
+        callback._save_checkpoint = timed_save_checkpoint
+
+    def teardown(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        stage: str | None = None,
+    ) -> None:
+        # drop the instance attributes to restore the methods
+        trainer.strategy.__dict__.pop("batch_to_device", None)
+        for callback in trainer.checkpoint_callbacks:
+            callback.__dict__.pop("_save_checkpoint", None)
+
+    def on_train_epoch_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        self._num_steps = 0
+        self._compile_time = compile_time()
+        self._last_end = time.perf_counter()
+
+    def on_validation_end(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        # do not count validation within an epoch as waiting for data
+        self._last_end = time.perf_counter()
+
+    def on_train_batch_start(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, batch, batch_idx: int
+    ) -> None:
+        self._batch_start = time.perf_counter()
+        self._before_backward = None
+        self._after_backward = None
+
+    def on_before_backward(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, loss: torch.Tensor
+    ) -> None:
+        self._before_backward = time.perf_counter()
+
+    def on_after_backward(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        self._after_backward = time.perf_counter()
+
+    def on_train_batch_end(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        outputs,
+        batch,
+        batch_idx: int,
+    ) -> None:
+        batch_end = time.perf_counter()
+        wait = self._batch_start - self._last_end
+        # with manual optimization the whole step is attributed to forward
+        before_backward = self._before_backward or batch_end
+        after_backward = self._after_backward or before_backward
+
+        row = self._buffer[self._num_steps % self.capacity]
+        row[0] = max(wait - self._transfer, 0.0)
+        row[1] = self._transfer
+        row[2] = before_backward - self._batch_start
+        row[3] = after_backward - before_backward
+        row[4] = batch_end - after_backward
+        row[5] = batch_end - self._last_end
+
+        self._num_steps += 1
+        self._last_end = batch_end
+
+    def on_train_epoch_end(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        log_dir = trainer.log_dir
+        if not self._num_steps or trainer.fast_dev_run:
+            return
+
+        num_rows = min(self._num_steps, self.capacity)
+        timings = torch.tensor(self._buffer[:num_rows], dtype=torch.float64)
+        quantiles = timings.quantile(
+            torch.tensor([0.5, 0.9, 0.99], dtype=torch.float64), dim=0
+        )
+
+        epoch_timings = {
+            "epoch": trainer.current_epoch,
+            "steps": self._num_steps,
+            "compile_time": compile_time() - self._compile_time,
+            "checkpoint_time": self._checkpoint_time,
+        }
+        self._checkpoint_time = 0.0
+        for i, phase in enumerate(PHASES):
+            epoch_timings[phase] = {
+                "mean": timings[:, i].mean().item(),
+                "p50": quantiles[0, i].item(),
+                "p90": quantiles[1, i].item(),
+                "p99": quantiles[2, i].item(),
+            }
+
+        data_wait, step = epoch_timings["data_wait"], epoch_timings["step"]
+        starved = data_wait["p50"] > self.starvation_threshold * step["p50"]
+        epoch_timings["loader_starved"] = starved
+        if starved:
+            rank_zero_warn(
+                f"Epoch {trainer.current_epoch}: waiting for data takes"
+                f" {data_wait['p50'] / step['p50']:.0%} of the median step time,"
+                " consider increasing `num_workers`."
+            )
+
+        self._timings.append(epoch_timings)
+        self._save(log_dir)
+
+    @rank_zero_only
+    def _save(self, log_dir: str) -> None:
+        timings_str = json.dumps(self._timings, ensure_ascii=False, indent=2)
+
+        timings_file = Path(log_dir) / "timings.json"
+        with timings_file.open("w") as f:
+            f.write(timings_str)
@@ -0,0 +1,190 @@
+import json
+import os
+from pathlib import Path
+from typing import Literal
+
+import lightning as L
+import numpy as np
+import torch
+from lightning.pytorch.trainer.states import TrainerFn
+from lightning.pytorch.utilities.data import _update_dataloader
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
+
+
+class _StridedSampler(DistributedSampler):
+    # `rank::num_replicas` in order and without padding, skipping the first `start`
+    # samples of the rank. Subclassing `DistributedSampler` keeps Lightning from
+    # injecting its own.
+    def __init__(self, dataset, num_replicas: int, rank: int, start: int = 0):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=False)
+        self.indices = range(rank, len(dataset), num_replicas)[start:]
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+class PredictionWriter(L.Callback):
+    r"""
+    Stream the outputs of ``predict_step`` to sharded files in ``output_dir``.
+
+    Each rank buffers the outputs of its batches and writes a shard every
+    ``shard_size`` rows, named ``{dataloader_idx}-{rank}-{start}-{end}.{format}``
+    where ``start`` and ``end`` are the row range of the rank. Rows contain the
+    ``index`` of the sample in the dataset, ranks predict ``rank::world_size``,
+    so packed datasets, whose rows hold several samples, are not supported.
+    Shards are written atomically, so an interrupted job resumes after the last
+    completed shard of each rank when run again with the same ``output_dir`` and
+    number of devices.
+
+    ``predict_step`` should return a dict of tensors with the batch as first
+    dimension. Predictions are not accumulated in memory.
+
+    Args:
+        output_dir: Directory of the shards.
+        shard_size: Minimum number of rows per shard.
+        format: ``jsonl`` for one JSON object per row or ``npz`` for one array
+            per key.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        shard_size: int = 100_000,
+        format: Literal["jsonl", "npz"] = "jsonl",
+    ):
+        self.output_dir = Path(output_dir)
+        self.shard_size = shard_size
+        self.format = format
+
+        self._buffers = {}
+        self._starts = {}
+        self._strided = {}
+
+    def setup(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, stage: str
+    ) -> None:
+        if stage != TrainerFn.PREDICTING:
+            return
+        datamodule = trainer.datamodule
+        if datamodule is not None and datamodule.hparams.get("packing"):
+            raise ValueError("`PredictionWriter` is not supported with `packing`.")
+
+        trainer.predict_loop.return_predictions = False
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # wrap `predict_dataloader` of the datamodule (or model) to resume
+        source = trainer.predict_loop._data_source
+        if not isinstance(source.instance, L.LightningModule | L.LightningDataModule):
+            return
+        predict_dataloader = getattr(source.instance, source.name)
+
+        def resumable_predict_dataloader():
+            dataloaders = predict_dataloader()
+            if isinstance(dataloaders, DataLoader):
+                return self._resume(trainer, dataloaders, 0)
+            return [self._resume(trainer, x, i) for i, x in enumerate(dataloaders)]
+
+        setattr(source.instance, source.name, resumable_predict_dataloader)
+        self._source = source
+
+    def teardown(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        stage: str | None = None,
+    ) -> None:
+        if stage == TrainerFn.PREDICTING and hasattr(self, "_source"):
+            # drop the instance attribute to restore the method
+            self._source.instance.__dict__.pop(self._source.name, None)
+            del self._source
+
+    def _resume(
+        self, trainer: L.Trainer, dataloader: DataLoader, dataloader_idx: int
+    ) -> DataLoader:
+        rank, world_size = trainer.global_rank, trainer.world_size
+        ends = [
+            int(x.stem.split("-")[-1])
+            for x in self.output_dir.glob(
+                f"{dataloader_idx}-{rank:05d}-*.{self.format}"
+            )
+        ]
+        start = max(ends, default=0)
+        self._starts[dataloader_idx] = start
+
+        # iterable datasets are split across ranks by themselves
+        self._strided[dataloader_idx] = not isinstance(
+            dataloader.dataset, IterableDataset
+        )
+        if not self._strided[dataloader_idx]:
+            if start > 0:
+                raise ValueError(
+                    "Resuming predictions is not supported for iterable datasets."
+                )
+            return dataloader
+
+        sampler = _StridedSampler(dataloader.dataset, world_size, rank, start)
+        return _update_dataloader(dataloader, sampler)
+
+    def on_predict_batch_end(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        outputs: dict[str, torch.Tensor],
+        batch,
+        batch_idx: int,
+        dataloader_idx: int = 0,
+    ) -> None:
+        buffer = self._buffers.setdefault(dataloader_idx, [])
+        buffer.append({k: v.detach().cpu().numpy() for k, v in outputs.items()})
+
+        if sum(len(next(iter(x.values()))) for x in buffer) >= self.shard_size:
+            self._flush(trainer, dataloader_idx)
+
+        # Lightning records the indices of every batch for `BasePredictionWriter`,
+        # which is not used here, drop them to keep memory bounded
+        dataloaders = trainer.predict_dataloaders
+        if isinstance(dataloaders, DataLoader):
+            dataloaders = [dataloaders]
+        batch_sampler = getattr(dataloaders[dataloader_idx], "batch_sampler", None)
+        if hasattr(batch_sampler, "seen_batch_indices"):
+            batch_sampler.seen_batch_indices.clear()
+
+    def on_predict_epoch_end(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        for dataloader_idx in list(self._buffers):
+            self._flush(trainer, dataloader_idx)
+
+    def _flush(self, trainer: L.Trainer, dataloader_idx: int) -> None:
+        buffer = self._buffers.pop(dataloader_idx, [])
+        if not buffer:
+            return
+
+        outputs = {k: np.concatenate([x[k] for x in buffer]) for k in buffer[0]}
+        start = self._starts.get(dataloader_idx, 0)
+        end = start + len(next(iter(outputs.values())))
+        if self._strided.get(dataloader_idx, False):
+            rows = np.arange(start, end)
+            outputs = {
+                "index": trainer.global_rank + rows * trainer.world_size,
+                **outputs,
+            }
+
+        rank = trainer.global_rank
+        path = self.output_dir / f"{dataloader_idx}-{rank:05d}-{start:012d}-{end:012d}"
+        path = path.with_suffix(f".{self.format}")
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with tmp_path.open("wb") as f:
+            if self.format == "npz":
+                np.savez(f, **outputs)
+            else:
+                keys, columns = list(outputs), [x.tolist() for x in outputs.values()]
+                for row in zip(*columns, strict=True):
+                    line = json.dumps(dict(zip(keys, row, strict=True)))
+                    f.write(line.encode() + b"\n")
+        os.replace(tmp_path, path)
+
+        self._starts[dataloader_idx] = end
@@ -0,0 +1,82 @@
+import json
+
+import lightning as L
+from lightning.fabric.utilities.apply_func import convert_tensors_to_scalars
+
+
+class TuneReport(L.Callback):
+    r"""
+    Report the metrics of every validation during fitting to Ray Tune, so that
+    schedulers can stop unpromising trials early, and those of the run for
+    ``validate`` and ``test``.
+
+    Args:
+        report_file: Append the metrics as JSON lines to this file instead of
+            calling ``ray.train.report``, for trials that run in a subprocess and
+            are streamed to Tune by ``sweep_cli.run_cli``.
+        result_file: Write the log dir and all reported metrics to this file at
+            the end of the run, for ``sweep_cli.run_cli`` to cache finished
+            trials. Nothing is written if nothing was reported.
+    """
+
+    def __init__(self, report_file: str | None = None, result_file: str | None = None):
+        self.report_file = report_file
+        self.result_file = result_file
+        # the stage of the run, nested runs, e.g., of `Metric`, are not reported
+        self._stage = None
+        self._reports = []
+
+    def setup(
+        self, trainer: L.Trainer, pl_module: L.LightningModule, stage: str
+    ) -> None:
+        if self._stage is None:
+            self._stage = stage
+            self._reports = []
+
+    def on_validation_end(
+        self, trainer: L.Trainer, pl_module: L.LightningModule
+    ) -> None:
+        if not trainer.sanity_checking:
+            self._on_end(trainer)
+
+    def on_test_end(self, trainer: L.Trainer, pl_module: L.LightningModule) -> None:
+        self._on_end(trainer)
+
+    def _on_end(self, trainer: L.Trainer) -> None:
+        if trainer.state.fn != self._stage:
+            return
+
+        metrics = convert_tensors_to_scalars(trainer.callback_metrics)
+        metrics = {k: v for k, v in metrics.items() if isinstance(v, int | float)}
+        metrics["epoch"] = trainer.current_epoch
+        metrics["step"] = trainer.global_step
+
+        if trainer.is_global_zero:
+            self._report(metrics)
+            self._reports.append(metrics)
+
+    def _report(self, metrics: dict[str, float]) -> None:
+        if self.report_file is not None:
+            with open(self.report_file, "a") as f:
+                f.write(json.dumps(metrics) + "\n")
+        else:
+            from ray import train
+
+            train.report(metrics)
+
+    def teardown(
+        self,
+        trainer: L.Trainer,
+        pl_module: L.LightningModule,
+        stage: str,
+    ) -> None:
+        if stage != self._stage:
+            return
+        self._stage = None
+
+        if self.result_file is None or not trainer.is_global_zero:
+            return
+        # the same metrics as a live trial reported, for cached trials to replay
+        if self._reports:
+            with open(self.result_file, "w") as f:
+                json.dump({"log_dir": trainer.log_dir, "reports": self._reports}, f)
@@ -1,4 +1,17 @@
-from .glue_datamodule import GLUEDataModule
-from .mnist_datamodule import MNISTDataModule
+import importlib
 
-__all__ = ["GLUEDataModule", "MNISTDataModule"]
+# imported on first access, e.g., when the CLI resolves `class_path`, so that a run
+# imports only the datamodule it selects
+_MODULES = {
+    "GLUEDataModule": ".glue_datamodule",
+    "GLUEMultiTaskDataModule": ".glue_multitask_datamodule",
+    "MNISTDataModule": ".mnist_datamodule",
+}
+
+__all__ = ["GLUEDataModule", "GLUEMultiTaskDataModule", "MNISTDataModule"]
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_MODULES[name], __name__), name)
@@ -0,0 +1,3 @@
+from .mnist import InMemoryMNIST
+
+__all__ = ["InMemoryMNIST"]
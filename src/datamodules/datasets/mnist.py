@@ -0,0 +1,34 @@
+import torch
+from torch.utils.data import Dataset
+
+
+class InMemoryMNIST(Dataset):
+    r"""
+    MNIST split held as one contiguous ``uint8`` tensor.
+
+    Batches are gathered and normalized with a single indexing op through
+    ``__getitems__``, so the ``DataLoader`` does no per-sample work. Pass
+    :meth:`collate_fn` to the ``DataLoader`` as the batches are already stacked.
+    """
+
+    def __init__(self, data: torch.Tensor, targets: torch.Tensor):
+        self.data = data.contiguous()
+        self.targets = targets.contiguous()
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        x, y = self.__getitems__([index])
+        return x[0], y[0]
+
+    def __getitems__(self, indices: list[int]) -> tuple[torch.Tensor, torch.Tensor]:
+        indices = torch.as_tensor(indices)
+        # same output as `transforms.ToTensor()`: (N, 1, 28, 28) floats in [0, 1]
+        x = self.data[indices].unsqueeze(1).float().div_(255)
+        y = self.targets[indices]
+        return x, y
+
+    @staticmethod
+    def collate_fn(batch: tuple[torch.Tensor, torch.Tensor]):
+        return batch
@@ -1,15 +1,26 @@
-import warnings
+import shutil
 from functools import partial
-from typing import Literal
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
 
 import lightning as L
-from datasets import load_dataset
+import torch
 from lightning.pytorch.utilities.types import EVAL_DATALOADERS, TRAIN_DATALOADERS
 from torch.utils.data import DataLoader
 
-warnings.filterwarnings(
-    "ignore", ".*Consider increasing the value of the `num_workers` argument*"
-)
+from ..utils.trial_cache import cached
+
+if TYPE_CHECKING:
+    from datasets import DatasetDict, IterableDatasetDict
+
+
+# datasets is imported lazily to keep CLI startup fast
+@cached
+def load_features(dataset_path: Path) -> "DatasetDict":
+    from datasets import load_from_disk
+
+    return load_from_disk(dataset_path)
+
 
 TASK_NAME = Literal[
     "cola",
@@ -55,45 +66,162 @@ class GLUEDataModule(L.LightningDataModule):
     def __init__(
         self,
         task_name: TASK_NAME = "mrpc",
+        data_dir: str = "data/",
         batch_size: int = 32,
         num_workers: int = 0,
         pin_memory: bool = False,
+        group_by_length: bool = False,
+        num_proc: int | None = None,
+        streaming: bool = False,
+        shuffle_buffer_size: int = 10_000,
+        packing: bool = False,
     ):
         super().__init__()
         self.save_hyperparameters()
 
+        if streaming and group_by_length:
+            raise ValueError("`group_by_length` is not supported with `streaming`.")
+        if streaming and packing:
+            raise ValueError("`packing` is not supported with `streaming`.")
+
         self.task_name = task_name
         self.num_labels = self.glue_task_num_labels[task_name]
         self.text_fields = self.task_text_field_map[task_name]
 
+    @property
+    def cache_path(self) -> Path:
+        # fingerprint the feature function so that tokenizer and max_length
+        # changes invalidate the cache
+        from datasets.fingerprint import Hasher
+
+        fingerprint = Hasher.hash(self.trainer.model.convert_to_features)
+        return Path(self.hparams.data_dir) / "glue" / f"{self.task_name}-{fingerprint}"
+
     def prepare_data(self) -> None:
-        # setup first to prevent datasets cache conflicts in multiple processes.
-        self.setup()
+        # tokenize once on the main process and persist the features, all ranks
+        # and later runs memory-map them in `setup`.
+        if self.hparams.streaming:
+            return
 
-    def setup(self, stage: str | None = None) -> None:
-        if not hasattr(self, "datasets"):
-            convert_to_features = self.trainer.model.convert_to_features
-            preprocess_fn = partial(self._preprocess, text_fields=self.text_fields)
+        cache_path = self.cache_path
+        if cache_path.exists():
+            return
 
-            def preprocess(x):
-                return convert_to_features(preprocess_fn(x))
+        from datasets import load_dataset
 
-            datasets = load_dataset("glue", self.task_name)
-            columns_names = self.text_fields + ["label", "idx"]
-            self.datasets = datasets.map(
-                preprocess,
-                batched=True,
-                remove_columns=columns_names,
+        convert_to_features = self.trainer.model.convert_to_features
+        preprocess_fn = partial(self._preprocess, text_fields=self.text_fields)
+
+        def preprocess(x):
+            return convert_to_features(preprocess_fn(x))
+
+        datasets = load_dataset("glue", self.task_name)
+        columns_names = self.text_fields + ["label", "idx"]
+        datasets = datasets.map(
+            preprocess,
+            batched=True,
+            remove_columns=columns_names,
+            num_proc=self.hparams.num_proc,
+        )
+
+        tmp_path = cache_path.with_name(f"{cache_path.name}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        datasets.save_to_disk(tmp_path)
+        tmp_path.rename(cache_path)
+
+    def setup(self, stage: str | None = None) -> None:
+        hparams = self.trainer.model.hparams
+        if self.hparams.packing and not (
+            hparams.get("dynamic_padding") and hparams.get("max_length")
+        ):
+            raise ValueError(
+                "`packing` requires `dynamic_padding` and `max_length` of the model."
             )
 
-            self.datasets.set_format(type="torch")
+        if not hasattr(self, "datasets"):
+            if self.hparams.streaming:
+                self.datasets = self._load_streaming_datasets(stage)
+            else:
+                self.datasets = self._load_datasets()
 
             self.val_splits = [x for x in self.datasets if "validation" in x]
             self.test_splits = [x for x in self.datasets if "test" in x]
 
         self.collate_fn = getattr(self.trainer.model, "collate_fn", None)
+        if self.hparams.packing:
+            self.collate_fn = partial(
+                self._collate_packed, pack_length=hparams.max_length
+            )
+
+    def _load_datasets(self) -> "DatasetDict":
+        datasets = load_features(self.cache_path)
+
+        if self.hparams.packing:
+            # concatenate short examples into rows of up to max_length tokens
+            datasets = datasets.map(
+                self._pack,
+                batched=True,
+                remove_columns=datasets["train"].column_names,
+                fn_kwargs={"pack_length": self.trainer.model.hparams.max_length},
+                num_proc=self.hparams.num_proc,
+            )
+
+        if self.hparams.group_by_length:
+            self.train_lengths = [len(x) for x in datasets["train"]["input_ids"]]
+
+        # a copy, the result of `load_features` is shared across trials
+        datasets = datasets.with_format("torch")
+
+        return datasets
+
+    def _load_streaming_datasets(self, stage: str | None) -> "IterableDatasetDict":
+        from datasets import load_dataset
+        from datasets.distributed import split_dataset_by_node
+
+        if stage == "fit" and self.trainer.max_steps == -1:
+            raise ValueError("`streaming` requires `trainer.max_steps` to be set.")
+
+        convert_to_features = self.trainer.model.convert_to_features
+        preprocess_fn = partial(self._preprocess, text_fields=self.text_fields)
+
+        def preprocess(x):
+            return convert_to_features(preprocess_fn(x))
+
+        datasets = load_dataset("glue", self.task_name, streaming=True)
+        columns_names = self.text_fields + ["label", "idx"]
+        for split, dataset in datasets.items():
+            # split parquet files per row group so that dataloader workers get
+            # their own shards, then split shards (or examples) across ranks.
+            dataset = dataset.reshard()
+            dataset = split_dataset_by_node(
+                dataset,
+                rank=self.trainer.global_rank,
+                world_size=self.trainer.world_size,
+            )
+            if split == "train":
+                dataset = dataset.shuffle(
+                    seed=torch.initial_seed(),
+                    buffer_size=self.hparams.shuffle_buffer_size,
+                )
+            dataset = dataset.map(
+                preprocess,
+                batched=True,
+                remove_columns=columns_names,
+            )
+            datasets[split] = dataset.with_format(type="torch")
+
+        return datasets
 
     def train_dataloader(self) -> TRAIN_DATALOADERS:
+        sampler = None
+        if self.hparams.group_by_length:
+            from transformers.trainer_pt_utils import LengthGroupedSampler
+
+            # shuffle megabatches and sort within them to batch similar lengths
+            sampler = LengthGroupedSampler(
+                self.hparams.batch_size,
+                lengths=self.train_lengths,
+            )
         return DataLoader(
             dataset=self.datasets["train"],
             batch_size=self.hparams.batch_size,
@@ -101,7 +229,8 @@ class GLUEDataModule(L.LightningDataModule):
             pin_memory=self.hparams.pin_memory,
             collate_fn=self.collate_fn,
             persistent_workers=self.hparams.num_workers > 0,
-            shuffle=True,
+            sampler=sampler,
+            shuffle=sampler is None and not self.hparams.streaming,
         )
 
     def val_dataloader(self) -> EVAL_DATALOADERS:
@@ -136,6 +265,9 @@ class GLUEDataModule(L.LightningDataModule):
 
         return test_dataloaders[0] if len(test_dataloaders) == 1 else test_dataloaders
 
+    def predict_dataloader(self) -> EVAL_DATALOADERS:
+        return self.test_dataloader()
+
     @staticmethod
     def _preprocess(batch, text_fields):
         if len(text_fields) > 1:
@@ -145,3 +277,41 @@ class GLUEDataModule(L.LightningDataModule):
         labels = batch["label"]
 
         return {"text": text, "labels": labels}
+
+    @staticmethod
+    def _pack(batch, pack_length):
+        # fill rows with whole examples in order. Positions restart at every
+        # example and tokens are tagged with the (1-based) index of their example
+        # in the row, which the model turns into a block-diagonal attention mask.
+        columns = [k for k in batch if k not in ["labels", "attention_mask"]]
+        packed = {k: [] for k in [*columns, "position_ids", "sequence_ids", "labels"]}
+        length, num_sequences = pack_length, 0
+        for i, input_ids in enumerate(batch["input_ids"]):
+            n = len(input_ids)
+            if length + n > pack_length:
+                for v in packed.values():
+                    v.append([])
+                length, num_sequences = 0, 0
+            length += n
+            num_sequences += 1
+            for k in columns:
+                packed[k][-1].extend(batch[k][i])
+            packed["position_ids"][-1].extend(range(n))
+            packed["sequence_ids"][-1].extend([num_sequences] * n)
+            packed["labels"][-1].append(batch["labels"][i])
+
+        return packed
+
+    @staticmethod
+    def _collate_packed(rows, pack_length):
+        # pad rows to the pack length with zeros (sequence id 0 marks padding),
+        # labels are flattened to one per example
+        batch = {"labels": torch.cat([x["labels"] for x in rows])}
+        for k in rows[0]:
+            if k == "labels":
+                continue
+            batch[k] = torch.zeros(len(rows), pack_length, dtype=rows[0][k].dtype)
+            for i, x in enumerate(rows):
+                batch[k][i, : len(x[k])] = x[k]
+
+        return batch
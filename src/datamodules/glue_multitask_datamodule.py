@@ -0,0 +1,217 @@
+from collections.abc import Callable, Iterator
+from functools import cached_property, partial
+
+import lightning as L
+import torch
+from lightning.pytorch.utilities.types import EVAL_DATALOADERS, TRAIN_DATALOADERS
+from torch.utils.data import (
+    ConcatDataset,
+    DataLoader,
+    Dataset,
+    Sampler,
+    default_collate,
+)
+
+from .glue_datamodule import TASK_NAME, GLUEDataModule
+
+
+class _TaskDataset(Dataset):
+    # tag the examples with their task, the collate function moves it to the batch
+    def __init__(self, dataset: Dataset, task_name: str):
+        self.dataset = dataset
+        self.task_name = task_name
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> dict:
+        return {**self.dataset[index], "task": self.task_name}
+
+
+def _collate(examples: list[dict], collate_fn: Callable | None = None) -> dict:
+    task_name = examples[0]["task"]
+    examples = [{k: v for k, v in x.items() if k != "task"} for x in examples]
+    batch = (collate_fn or default_collate)(examples)
+    batch["task"] = task_name
+
+    return batch
+
+
+class _TaskBatchSampler(Sampler[list[int]]):
+    # Batches of a single task each, in the indices of the concatenated datasets.
+    # Tasks are drawn with probability proportional to `size ** (1 / temperature)`,
+    # the examples of a task are reshuffled once all were drawn. Every rank draws
+    # the same tasks and takes its share of each global batch, the last examples of
+    # a task are dropped if they are too few for every rank to get one.
+    def __init__(
+        self,
+        sizes: list[int],
+        batch_size: int,
+        temperature: float = 1.0,
+        num_replicas: int = 1,
+        rank: int = 0,
+        seed: int = 0,
+    ):
+        if min(sizes) < num_replicas:
+            raise ValueError(
+                f"Every task needs at least {num_replicas} examples, one per rank."
+            )
+        self.sizes = sizes
+        self.batch_size = batch_size
+        self.temperature = temperature
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        return max(sum(self.sizes) // (self.batch_size * self.num_replicas), 1)
+
+    def __iter__(self) -> Iterator[list[int]]:
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        probs = torch.tensor(self.sizes, dtype=torch.float64) ** (1 / self.temperature)
+        tasks = torch.multinomial(
+            probs, len(self), replacement=True, generator=generator
+        )
+
+        offsets = [sum(self.sizes[:i]) for i in range(len(self.sizes))]
+        perms = [torch.randperm(n, generator=generator) for n in self.sizes]
+        positions = [0] * len(self.sizes)
+        global_batch_size = self.batch_size * self.num_replicas
+        for task in tasks.tolist():
+            if self.sizes[task] - positions[task] < self.num_replicas:
+                perms[task] = torch.randperm(self.sizes[task], generator=generator)
+                positions[task] = 0
+            start = positions[task]
+            positions[task] += global_batch_size
+            indices = perms[task][start : positions[task]][
+                self.rank :: self.num_replicas
+            ]
+            yield (indices + offsets[task]).tolist()
+
+
+class GLUEMultiTaskDataModule(L.LightningDataModule):
+    r"""
+    Several GLUE tasks for ``GLUEMultiTaskTransformer``.
+
+    The features of each task are prepared and cached by a ``GLUEDataModule``,
+    shared with single-task runs. Training batches hold examples of a single
+    task, drawn with probability proportional to the size of the task to the
+    power of ``1 / temperature``: 1 samples proportionally to the sizes, larger
+    values flatten the distribution towards uniform. An epoch has as many
+    examples as all tasks together. Evaluation has one dataloader per task and
+    split.
+
+    With several devices, set ``trainer.use_distributed_sampler`` to ``false``,
+    the batch sampler splits the batches across ranks itself.
+
+    Args:
+        task_names: GLUE tasks.
+        data_dir: Directory of the cached features.
+        batch_size: Batch size.
+        num_workers: Number of dataloader workers.
+        pin_memory: Pin memory of the batches.
+        num_proc: Number of processes to tokenize with.
+        temperature: Sampling temperature of the tasks.
+    """
+
+    def __init__(
+        self,
+        task_names: list[TASK_NAME],
+        data_dir: str = "data/",
+        batch_size: int = 32,
+        num_workers: int = 0,
+        pin_memory: bool = False,
+        num_proc: int | None = None,
+        temperature: float = 1.0,
+    ):
+        super().__init__()
+        self.save_hyperparameters()
+
+        self.task_names = list(task_names)
+        self.num_labels = {
+            x: GLUEDataModule.glue_task_num_labels[x] for x in self.task_names
+        }
+
+    @cached_property
+    def datamodules(self) -> dict[str, GLUEDataModule]:
+        # built outside `__init__`, where LightningCLI would give them the
+        # hyperparameters of this datamodule
+        return {
+            x: GLUEDataModule(
+                task_name=x,
+                data_dir=self.hparams.data_dir,
+                batch_size=self.hparams.batch_size,
+                num_workers=self.hparams.num_workers,
+                pin_memory=self.hparams.pin_memory,
+                num_proc=self.hparams.num_proc,
+            )
+            for x in self.task_names
+        }
+
+    def prepare_data(self) -> None:
+        for datamodule in self.datamodules.values():
+            datamodule.trainer = self.trainer
+            datamodule.prepare_data()
+
+    def setup(self, stage: str | None = None) -> None:
+        for datamodule in self.datamodules.values():
+            datamodule.trainer = self.trainer
+            datamodule.setup(stage)
+
+        # (task, split) of every evaluation dataloader
+        self.val_splits = [
+            (k, x) for k, v in self.datamodules.items() for x in v.val_splits
+        ]
+        self.test_splits = [
+            (k, x) for k, v in self.datamodules.items() for x in v.test_splits
+        ]
+        self.collate_fn = partial(
+            _collate, collate_fn=getattr(self.trainer.model, "collate_fn", None)
+        )
+
+    def train_dataloader(self) -> TRAIN_DATALOADERS:
+        datasets = [
+            _TaskDataset(v.datasets["train"], k) for k, v in self.datamodules.items()
+        ]
+        batch_sampler = _TaskBatchSampler(
+            [len(x) for x in datasets],
+            self.hparams.batch_size,
+            temperature=self.hparams.temperature,
+            num_replicas=self.trainer.world_size,
+            rank=self.trainer.global_rank,
+            seed=torch.initial_seed(),
+        )
+        return DataLoader(
+            dataset=ConcatDataset(datasets),
+            batch_sampler=batch_sampler,
+            num_workers=self.hparams.num_workers,
+            pin_memory=self.hparams.pin_memory,
+            collate_fn=self.collate_fn,
+            persistent_workers=self.hparams.num_workers > 0,
+        )
+
+    def val_dataloader(self) -> EVAL_DATALOADERS:
+        return [self._eval_dataloader(*x) for x in self.val_splits]
+
+    def test_dataloader(self) -> EVAL_DATALOADERS:
+        return [self._eval_dataloader(*x) for x in self.test_splits]
+
+    def predict_dataloader(self) -> EVAL_DATALOADERS:
+        return self.test_dataloader()
+
+    def _eval_dataloader(self, task_name: str, split: str) -> DataLoader:
+        return DataLoader(
+            dataset=_TaskDataset(
+                self.datamodules[task_name].datasets[split], task_name
+            ),
+            batch_size=self.hparams.batch_size,
+            num_workers=self.hparams.num_workers,
+            pin_memory=self.hparams.pin_memory,
+            collate_fn=self.collate_fn,
+            persistent_workers=self.hparams.num_workers > 0,
+            shuffle=False,
+        )
@@ -1,8 +1,13 @@
+from typing import TYPE_CHECKING
+
 import lightning as L
 from lightning.pytorch.utilities.types import EVAL_DATALOADERS, TRAIN_DATALOADERS
-from torch.utils.data import DataLoader, random_split
-from torchvision.datasets import MNIST
-from torchvision.transforms import transforms
+from torch.utils.data import DataLoader, Subset, random_split
+
+from .datasets import InMemoryMNIST
+
+if TYPE_CHECKING:
+    from torchvision.datasets import MNIST
 
 
 class MNISTDataModule(L.LightningDataModule):
@@ -12,19 +17,27 @@ class MNISTDataModule(L.LightningDataModule):
         batch_size: int = 64,
         num_workers: int = 0,
         pin_memory: bool = False,
+        in_memory: bool = True,
     ):
         super().__init__()
         self.save_hyperparameters()
 
-        self.transforms = transforms.ToTensor()
+        self.collate_fn = InMemoryMNIST.collate_fn if in_memory else None
         self.data = {}
 
     def prepare_data(self) -> None:
+        # torchvision is imported lazily to keep CLI startup fast
+        from torchvision.datasets import MNIST
+
         MNIST(self.hparams.data_dir, train=True, download=True)
         MNIST(self.hparams.data_dir, train=False, download=True)
 
     def setup(self, stage: str | None = None) -> None:
         if not self.data:
+            from torchvision.datasets import MNIST
+            from torchvision.transforms import transforms
+
+            self.transforms = transforms.ToTensor()
             dataset = MNIST(
                 self.hparams.data_dir, train=True, transform=self.transforms
             )
@@ -34,12 +47,26 @@ class MNISTDataModule(L.LightningDataModule):
                 self.hparams.data_dir, train=False, transform=self.transforms
             )
 
+            if self.hparams.in_memory:
+                self.data = {k: self._to_in_memory(v) for k, v in self.data.items()}
+
+    @staticmethod
+    def _to_in_memory(dataset: "MNIST | Subset") -> InMemoryMNIST:
+        # gather the split into contiguous tensors, keeping `random_split` indices
+        if isinstance(dataset, Subset):
+            data = dataset.dataset.data[dataset.indices]
+            targets = dataset.dataset.targets[dataset.indices]
+        else:
+            data, targets = dataset.data, dataset.targets
+        return InMemoryMNIST(data, targets)
+
     def train_dataloader(self) -> TRAIN_DATALOADERS:
         return DataLoader(
             dataset=self.data["train"],
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
+            collate_fn=self.collate_fn,
             persistent_workers=self.hparams.num_workers > 0,
             shuffle=True,
         )
@@ -50,6 +77,7 @@ class MNISTDataModule(L.LightningDataModule):
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
+            collate_fn=self.collate_fn,
             persistent_workers=self.hparams.num_workers > 0,
             shuffle=False,
         )
@@ -60,6 +88,10 @@ class MNISTDataModule(L.LightningDataModule):
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
+            collate_fn=self.collate_fn,
             persistent_workers=self.hparams.num_workers > 0,
             shuffle=False,
         )
+
+    def predict_dataloader(self) -> EVAL_DATALOADERS:
+        return self.test_dataloader()
@@ -1,4 +1,17 @@
-from .glue_transformer import GLUETransformer
-from .mnist_model import MNISTModel
+import importlib
 
-__all__ = ["GLUETransformer", "MNISTModel"]
+# imported on first access, e.g., when the CLI resolves `class_path`, so that a run
+# imports only the model it selects
+_MODULES = {
+    "GLUEMultiTaskTransformer": ".glue_multitask_transformer",
+    "GLUETransformer": ".glue_transformer",
+    "MNISTModel": ".mnist_model",
+}
+
+__all__ = ["GLUEMultiTaskTransformer", "GLUETransformer", "MNISTModel"]
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_MODULES[name], __name__), name)
@@ -0,0 +1,198 @@
+from collections import Counter
+from functools import partial
+from typing import Any, Literal
+
+import lightning as L
+import torch
+from lightning.pytorch.utilities.types import STEP_OUTPUT
+from torch import nn
+
+from ..utils.compile import compile_forward
+from ..utils.trial_cache import cached
+from .glue_transformer import GLUETransformer, load_tokenizer
+
+
+@cached(copy_result=True)
+def load_pretrained_encoder(model_name_or_path: str) -> torch.nn.Module:
+    from transformers import AutoModel
+
+    return AutoModel.from_pretrained(model_name_or_path)
+
+
+class GLUEMultiTaskTransformer(L.LightningModule):
+    r"""
+    One pretrained encoder shared by several GLUE tasks with a classification
+    (or regression) head per task, for ``GLUEMultiTaskDataModule``.
+
+    Each batch holds a single ``task``, whose head classifies the pooled first
+    token. Metrics are logged per task as ``{step}/{task}_{metric}``, e.g.,
+    ``val/mrpc_f1`` and ``val/mnli_matched_accuracy``.
+    """
+
+    def __init__(
+        self,
+        task_names: list[str],
+        model_name_or_path: str,
+        num_labels: dict[str, int],
+        max_length: int | None = None,
+        weight_decay: float = 0.0,
+        learning_rate: float = 2e-5,
+        scheduler_type: str = "linear",
+        warmup_steps: int = 0,
+        dynamic_padding: bool = False,
+        pad_to_multiple_of: int | None = None,
+        compile_kwargs: dict[str, Any] | None = None,
+        gradient_checkpointing: bool = False,
+        optimizer: Literal["adamw", "adafactor"] = "adamw",
+    ):
+        super().__init__()
+        self.save_hyperparameters()
+
+        # same features as single-task runs, which shares their cache
+        tokenizer = load_tokenizer(model_name_or_path)
+        self.convert_to_features = partial(
+            GLUETransformer._convert_to_features,
+            tokenizer=tokenizer,
+            max_length=max_length,
+            padding=False if dynamic_padding else "max_length",
+        )
+        if dynamic_padding:
+            from transformers import DataCollatorWithPadding
+
+            self.collate_fn = DataCollatorWithPadding(
+                tokenizer, pad_to_multiple_of=pad_to_multiple_of
+            )
+
+        self.encoder = load_pretrained_encoder(model_name_or_path).train()
+        if gradient_checkpointing:
+            self.encoder.gradient_checkpointing_enable(
+                gradient_checkpointing_kwargs={"use_reentrant": False}
+            )
+        config = self.encoder.config
+        dropout = getattr(config, "classifier_dropout", None)
+        if dropout is None:
+            dropout = getattr(config, "hidden_dropout_prob", 0.1)
+        self.heads = nn.ModuleDict(
+            {
+                x: nn.Sequential(
+                    nn.Dropout(dropout), nn.Linear(config.hidden_size, num_labels[x])
+                )
+                for x in task_names
+            }
+        )
+
+        if compile_kwargs is not None:
+            compile_forward(self, compile_kwargs)
+
+    def forward(self, batch):
+        from transformers.modeling_outputs import SequenceClassifierOutput
+
+        batch = dict(batch)
+        task_name = batch.pop("task")
+        labels = batch.pop("labels", None)
+
+        outputs = self.encoder(**batch)
+        pooled = getattr(outputs, "pooler_output", None)
+        if pooled is None:
+            pooled = outputs.last_hidden_state[:, 0]
+        logits = self.heads[task_name](pooled)
+
+        loss = None
+        if labels is not None:
+            if self.hparams.num_labels[task_name] == 1:
+                loss = nn.functional.mse_loss(logits.squeeze(-1), labels)
+            else:
+                loss = nn.functional.cross_entropy(logits, labels)
+
+        return SequenceClassifierOutput(loss=loss, logits=logits)
+
+    def setup(self, stage: str) -> None:
+        if hasattr(self, "train_metrics"):
+            return
+
+        self.train_metrics = nn.ModuleDict(
+            {x: self._build_metrics(x, f"train/{x}_") for x in self.hparams.task_names}
+        )
+        for step in ["val", "test"]:
+            splits = getattr(self.trainer.datamodule, f"{step}_splits", None) or []
+            # name the split only for tasks with several, e.g., MNLI
+            counts = Counter(task_name for task_name, _ in splits)
+            step_metrics = [
+                self._build_metrics(
+                    task_name,
+                    f"{step}/{task_name}_{split.split('_')[-1]}_"
+                    if counts[task_name] > 1
+                    else f"{step}/{task_name}_",
+                )
+                for task_name, split in splits
+            ]
+            setattr(self, f"{step}_metrics", nn.ModuleList(step_metrics))
+
+    def shared_step(self, batch, step: str, dataloader_idx: int = 0) -> STEP_OUTPUT:
+        task_name = batch["task"]
+        output = self.forward(batch)
+        loss, logits = output.loss, output.logits
+        labels = batch["labels"]
+
+        if self.hparams.num_labels[task_name] > 1:
+            preds = torch.argmax(logits, dim=1)
+        else:
+            preds = logits.squeeze(-1)
+
+        if step == "train":
+            metrics = self.train_metrics[task_name]
+        else:
+            metrics = getattr(self, f"{step}_metrics")[dataloader_idx]
+        metrics(preds, labels)
+
+        # metric states are synced across processes only when computed at epoch end
+        self.log(
+            f"{metrics.prefix}loss",
+            loss,
+            sync_dist=step != "train",
+            add_dataloader_idx=False,
+            batch_size=labels.size(0),
+        )
+        self.log_dict(
+            metrics,
+            prog_bar=step != "train",
+            add_dataloader_idx=False,
+            batch_size=labels.size(0),
+        )
+
+        return loss
+
+    def training_step(self, batch, batch_idx: int) -> STEP_OUTPUT:
+        return self.shared_step(batch, "train")
+
+    def validation_step(
+        self, batch, batch_idx: int, dataloader_idx: int = 0
+    ) -> STEP_OUTPUT | None:
+        return self.shared_step(batch, "val", dataloader_idx)
+
+    def test_step(
+        self, batch, batch_idx: int, dataloader_idx: int = 0
+    ) -> STEP_OUTPUT | None:
+        return self.shared_step(batch, "test", dataloader_idx)
+
+    def predict_step(
+        self, batch, batch_idx: int, dataloader_idx: int = 0
+    ) -> dict[str, torch.Tensor]:
+        # labels of unlabeled (e.g., GLUE test) splits are placeholders
+        batch = {k: v for k, v in batch.items() if k != "labels"}
+        logits = self.forward(batch).logits
+
+        if logits.size(-1) == 1:
+            return {"preds": logits.squeeze(-1)}
+        probs = torch.softmax(logits, dim=1)
+
+        return {"preds": torch.argmax(probs, dim=1), "probs": probs}
+
+    # same optimizer, weight decay groups and schedule as single-task runs
+    configure_optimizers = GLUETransformer.configure_optimizers
+
+    def _build_metrics(self, task_name: str, prefix: str):
+        metrics = GLUETransformer._build_metrics(
+            task_name, self.hparams.num_labels[task_name]
+        )
+        return metrics.clone(prefix=prefix)
@@ -1,17 +1,46 @@
 from functools import partial
-from typing import Any
+from typing import TYPE_CHECKING, Any, Literal
 
-import evaluate
 import lightning as L
 import torch
 from lightning.pytorch.utilities.types import STEP_OUTPUT
-from transformers import (
-    AutoModelForSequenceClassification,
-    AutoTokenizer,
-    PreTrainedTokenizer,
-    get_scheduler,
+from torch import nn
+from torchmetrics import (
+    Accuracy,
+    F1Score,
+    MatthewsCorrCoef,
+    MetricCollection,
+    PearsonCorrCoef,
+    SpearmanCorrCoef,
 )
 
+from ..utils.compile import compile_forward
+from ..utils.trial_cache import cached
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizer
+
+
+# transformers is imported lazily to keep CLI startup fast
+@cached
+def load_tokenizer(model_name_or_path: str) -> "PreTrainedTokenizer":
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(model_name_or_path)
+
+
+@cached(copy_result=True)
+def load_pretrained_model(model_name_or_path: str, **kwargs) -> torch.nn.Module:
+    from transformers import AutoModelForSequenceClassification
+
+    return AutoModelForSequenceClassification.from_pretrained(
+        model_name_or_path, **kwargs
+    )
+
+
+# BERT- and RoBERTa-style sequence classification heads
+PACKED_MODEL_TYPES = ("bert", "roberta")
+
 
 class GLUETransformer(L.LightningModule):
     def __init__(
@@ -24,111 +53,213 @@ class GLUETransformer(L.LightningModule):
         learning_rate: float = 2e-5,
         scheduler_type: str = "linear",
         warmup_steps: int = 0,
+        dynamic_padding: bool = False,
+        pad_to_multiple_of: int | None = None,
+        compile_kwargs: dict[str, Any] | None = None,
+        gradient_checkpointing: bool = False,
+        optimizer: Literal["adamw", "adafactor"] = "adamw",
+        lora_kwargs: dict[str, Any] | None = None,
     ):
         super().__init__()
         self.save_hyperparameters()
 
-        tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        tokenizer = load_tokenizer(model_name_or_path)
         self.convert_to_features = partial(
-            self._convert_to_features, tokenizer=tokenizer, max_length=max_length
+            self._convert_to_features,
+            tokenizer=tokenizer,
+            max_length=max_length,
+            padding=False if dynamic_padding else "max_length",
         )
-        self.model = AutoModelForSequenceClassification.from_pretrained(
-            model_name_or_path
+        if dynamic_padding:
+            from transformers import DataCollatorWithPadding
+
+            # pad each batch to its longest sequence instead of max_length,
+            # rounded up to bound the number of shapes a compiled forward sees
+            self.collate_fn = DataCollatorWithPadding(
+                tokenizer, pad_to_multiple_of=pad_to_multiple_of
+            )
+        self.model = load_pretrained_model(
+            model_name_or_path, num_labels=num_labels
         ).train()
-        self.metric = evaluate.load("glue", task_name)
+        if gradient_checkpointing:
+            # recompute the activations of the encoder layers in the backward pass
+            self.model.gradient_checkpointing_enable(
+                gradient_checkpointing_kwargs={"use_reentrant": False}
+            )
+
+        if lora_kwargs is not None:
+            from peft import LoraConfig, get_peft_model
 
-        self.validation_step_outputs = []
-        self.test_step_outputs = []
+            # freeze the backbone, train low-rank adapters and the classifier head
+            self.model = get_peft_model(
+                self.model, LoraConfig(task_type="SEQ_CLS", **lora_kwargs)
+            )
+
+        if compile_kwargs is not None:
+            compile_forward(self, compile_kwargs)
 
     def forward(self, batch):
+        if "sequence_ids" in batch:
+            return self._packed_forward(batch)
         return self.model.forward(**batch)
 
-    def shared_step(self, batch) -> STEP_OUTPUT | None:
+    def _packed_forward(self, batch):
+        # rows of several examples from `GLUEDataModule(packing=True)`
+        from transformers.modeling_outputs import SequenceClassifierOutput
+
+        batch = dict(batch)
+        sequence_ids = batch.pop("sequence_ids")
+        labels = batch.pop("labels", None)
+
+        # the transformers model under the LoRA wrapper
+        model = self.model
+        if hasattr(model, "get_base_model"):
+            model = model.get_base_model()
+
+        # block-diagonal additive mask: tokens attend to the tokens of their
+        # example only, padding to padding
+        dtype = model.dtype
+        same = sequence_ids[:, None, :, None] == sequence_ids[:, None, None, :]
+        mask = torch.zeros(same.shape, dtype=dtype, device=same.device)
+        mask = mask.masked_fill(~same, torch.finfo(dtype).min)
+        hidden = model.base_model(**batch, attention_mask=mask)[0]
+
+        # first token of every example, in the order of the labels
+        first = (batch["position_ids"] == 0) & (sequence_ids > 0)
+        hidden = hidden[first][:, None]
+        pooler = getattr(model.base_model, "pooler", None)
+        if pooler is not None:
+            # BERT-style heads classify the pooled first token
+            logits = model.classifier(model.dropout(pooler(hidden)))
+        else:
+            # RoBERTa-style heads pool the first token themselves
+            logits = model.classifier(hidden)
+
+        loss = None
+        if labels is not None:
+            if self.hparams.num_labels == 1:
+                loss = nn.functional.mse_loss(logits.squeeze(), labels.squeeze())
+            else:
+                loss = nn.functional.cross_entropy(logits, labels)
+
+        return SequenceClassifierOutput(loss=loss, logits=logits)
+
+    def setup(self, stage: str) -> None:
+        datamodule_hparams = getattr(self.trainer.datamodule, "hparams", {})
+        model_type = self.model.config.model_type
+        if datamodule_hparams.get("packing") and model_type not in PACKED_MODEL_TYPES:
+            # `_packed_forward` applies the classifier heads of these itself
+            raise ValueError(
+                f"`packing` supports the model types {PACKED_MODEL_TYPES}, got"
+                f" {model_type!r} of {self.hparams.model_name_or_path!r}."
+            )
+
+        if hasattr(self, "train_metrics"):
+            return
+
+        # one metric collection per dataloader, e.g. MNLI matched/mismatched
+        metrics = self._build_metrics(self.hparams.task_name, self.hparams.num_labels)
+        self.train_metrics = nn.ModuleList([metrics.clone(prefix="train/")])
+        for step in ["val", "test"]:
+            splits = getattr(self.trainer.datamodule, f"{step}_splits", None)
+            if splits and len(splits) > 1:
+                prefixes = [f"{step}/{x.split('_')[-1]}_" for x in splits]
+            else:
+                prefixes = [f"{step}/"]
+            step_metrics = [metrics.clone(prefix=prefix) for prefix in prefixes]
+            setattr(self, f"{step}_metrics", nn.ModuleList(step_metrics))
+
+    def shared_step(self, batch, step: str, dataloader_idx: int = 0) -> STEP_OUTPUT:
         output = self.forward(batch)
         loss, logits = output.loss, output.logits
         labels = batch["labels"]
 
-        if self.hparams.num_labels >= 1:
+        if self.hparams.num_labels > 1:
             preds = torch.argmax(logits, dim=1)
         elif self.hparams.num_labels == 1:
-            preds = logits.squeeze()
+            preds = logits.squeeze(-1)
+
+        metrics = getattr(self, f"{step}_metrics")[dataloader_idx]
+        metrics(preds, labels)
 
-        return {"loss": loss, "preds": preds, "labels": labels}
+        # metric states are synced across processes only when computed at epoch end,
+        # weight by examples rather than (packed) rows
+        self.log(
+            f"{metrics.prefix}loss",
+            loss,
+            sync_dist=step != "train",
+            add_dataloader_idx=False,
+            batch_size=labels.size(0),
+        )
+        self.log_dict(
+            metrics,
+            prog_bar=True,
+            add_dataloader_idx=False,
+            batch_size=labels.size(0),
+        )
+
+        return loss
 
-    def training_step(
-        self, batch, batch_idx: int, dataloader_idx: int | None = None
-    ) -> STEP_OUTPUT:
-        return self.shared_step(batch)
+    def training_step(self, batch, batch_idx: int) -> STEP_OUTPUT:
+        return self.shared_step(batch, "train")
 
     def validation_step(
-        self, batch, batch_idx: int, dataloader_idx: int | None = None
+        self, batch, batch_idx: int, dataloader_idx: int = 0
     ) -> STEP_OUTPUT | None:
-        output = self.shared_step(batch)
-        self.validation_step_outputs.append(output)
-        return output
+        return self.shared_step(batch, "val", dataloader_idx)
 
     def test_step(
-        self, batch, batch_idx: int, dataloader_idx: int | None = None
+        self, batch, batch_idx: int, dataloader_idx: int = 0
     ) -> STEP_OUTPUT | None:
-        output = self.shared_step(batch)
-        self.test_step_outputs.append(output)
-        return output
-
-    def shared_epoch_end(self, outputs, step: str) -> None:
-        if hasattr(self.trainer.datamodule, f"{step}_splits"):
-            splits = getattr(self.trainer.datamodule, f"{step}_splits")
-            if len(splits) > 1:
-                for i, output in enumerate(outputs):
-                    split = splits[i].split("_")[-1]
-                    preds = torch.cat([x["preds"] for x in output])
-                    labels = torch.cat([x["labels"] for x in output])
-                    loss = torch.stack([x["loss"] for x in output]).mean()
-
-                    split_metrics = {
-                        f"{step}/{split}_{k}": v
-                        for k, v in self.metric.compute(
-                            predictions=preds, references=labels
-                        ).items()
-                    }
-
-                    self.log(f"{step}/{split}_loss", loss)
-                    self.log_dict(split_metrics, prog_bar=True)
-
-                return loss
-
-        preds = torch.cat([x["preds"] for x in outputs])
-        labels = torch.cat([x["labels"] for x in outputs])
-        loss = torch.stack([x["loss"] for x in outputs]).mean()
-
-        metrics = {
-            f"{step}/{k}": v
-            for k, v in self.metric.compute(
-                predictions=preds, references=labels
-            ).items()
-        }
-
-        self.log(f"{step}/loss", loss)
-        self.log_dict(metrics, prog_bar=True)
-
-    def on_training_epoch_end(self) -> None:
-        self.shared_epoch_end(self.training_step_outputs, "train")
-
-    def on_validation_epoch_end(self) -> None:
-        self.shared_epoch_end(self.validation_step_outputs, "val")
-        self.validation_step_outputs.clear()
-
-    def on_test_epoch_end(self) -> None:
-        self.shared_epoch_end(self.test_step_outputs, "test")
-        self.test_step_outputs.clear()
+        return self.shared_step(batch, "test", dataloader_idx)
+
+    def predict_step(
+        self, batch, batch_idx: int, dataloader_idx: int = 0
+    ) -> dict[str, torch.Tensor]:
+        # labels of unlabeled (e.g., GLUE test) splits are placeholders
+        batch = {k: v for k, v in batch.items() if k != "labels"}
+        logits = self.forward(batch).logits
+
+        if self.hparams.num_labels == 1:
+            return {"preds": logits.squeeze(-1)}
+        probs = torch.softmax(logits, dim=1)
+
+        return {"preds": torch.argmax(probs, dim=1), "probs": probs}
+
+    def on_save_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        if self.hparams.lora_kwargs is not None:
+            # keep the trained delta only, the frozen backbone is reloaded from
+            # `model_name_or_path`
+            trainable = {n for n, p in self.named_parameters() if p.requires_grad}
+            checkpoint["state_dict"] = {
+                k: v for k, v in checkpoint["state_dict"].items() if k in trainable
+            }
+
+    def on_load_checkpoint(self, checkpoint: dict[str, Any]) -> None:
+        if self.hparams.lora_kwargs is not None:
+            checkpoint["state_dict"] = {**self.state_dict(), **checkpoint["state_dict"]}
+
+    def merge_adapters(self) -> None:
+        r"""Merge the LoRA adapters into the backbone weights for inference."""
+        if hasattr(self.model, "merge_and_unload"):
+            self.model = self.model.merge_and_unload()
+
+    def on_train_epoch_start(self) -> None:
+        # reshuffle iterable (streaming) datasets, which have no sampler to set
+        dataset = self.trainer.train_dataloader.dataset
+        if hasattr(dataset, "set_epoch"):
+            dataset.set_epoch(self.current_epoch)
 
     def configure_optimizers(self):
+        from transformers import get_scheduler
+
         no_decay = ["bias", "LayerNorm.weight"]
         optimizer_grouped_parameters = [
             {
                 "params": [
                     p
                     for n, p in self.named_parameters()
-                    if not any(nd in n for nd in no_decay)
+                    if p.requires_grad and not any(nd in n for nd in no_decay)
                 ],
                 "weight_decay": self.hparams.weight_decay,
             },
@@ -136,15 +267,23 @@ class GLUETransformer(L.LightningModule):
                 "params": [
                     p
                     for n, p in self.named_parameters()
-                    if any(nd in n for nd in no_decay)
+                    if p.requires_grad and any(nd in n for nd in no_decay)
                 ],
                 "weight_decay": 0.0,
             },
         ]
-        optimizer = torch.optim.AdamW(
-            optimizer_grouped_parameters,
-            lr=self.hparams.learning_rate,
-        )
+        if self.hparams.optimizer == "adafactor":
+            # factored second moments and no first moment, a fraction of the
+            # optimizer state of AdamW
+            optimizer = torch.optim.Adafactor(
+                optimizer_grouped_parameters,
+                lr=self.hparams.learning_rate,
+            )
+        else:
+            optimizer = torch.optim.AdamW(
+                optimizer_grouped_parameters,
+                lr=self.hparams.learning_rate,
+            )
 
         scheduler = get_scheduler(
             self.hparams.scheduler_type,
@@ -159,15 +298,33 @@ class GLUETransformer(L.LightningModule):
     @staticmethod
     def _convert_to_features(
         batch: dict[str, list] | list[Any],
-        tokenizer: PreTrainedTokenizer,
+        tokenizer: "PreTrainedTokenizer",
         max_length: int | None = None,
+        padding: bool | str = "max_length",
     ) -> dict | Any:
         features = tokenizer(
             batch["text"],
-            padding="max_length",
+            padding=padding,
             truncation=True,
             max_length=max_length,
         )
         features["labels"] = batch["labels"]
 
         return features
+
+    @staticmethod
+    def _build_metrics(task_name: str, num_labels: int) -> MetricCollection:
+        # same metrics and names as `evaluate.load("glue", task_name)`
+        if task_name == "cola":
+            metrics = {"matthews_correlation": MatthewsCorrCoef(task="binary")}
+        elif task_name == "stsb":
+            metrics = {"pearson": PearsonCorrCoef(), "spearmanr": SpearmanCorrCoef()}
+        elif task_name in ["mrpc", "qqp"]:
+            metrics = {
+                "accuracy": Accuracy(task="multiclass", num_classes=num_labels),
+                "f1": F1Score(task="binary"),
+            }
+        else:
+            metrics = {"accuracy": Accuracy(task="multiclass", num_classes=num_labels)}
+
+        return MetricCollection(metrics)
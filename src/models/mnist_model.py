@@ -1,3 +1,5 @@
+from typing import Any
+
 import lightning as L
 import torch
 import torch.nn.functional as F
@@ -5,6 +7,8 @@ from lightning.pytorch.callbacks import EarlyStopping, ModelCheckpoint
 from lightning.pytorch.utilities.types import STEP_OUTPUT
 from torchmetrics import Accuracy, MetricCollection
 
+from ..utils.compile import compile_forward
+
 
 class MNISTModel(L.LightningModule):
     def __init__(
@@ -13,6 +17,7 @@ class MNISTModel(L.LightningModule):
         hidden_dim: int = 128,
         output_size: int = 10,
         learning_rate: float = 1e-3,
+        compile_kwargs: dict[str, Any] | None = None,
     ):
         super().__init__()
         self.save_hyperparameters()
@@ -25,6 +30,9 @@ class MNISTModel(L.LightningModule):
         self.val_metrics = metrics.clone(prefix="val/")
         self.test_metrics = metrics.clone(prefix="test/")
 
+        if compile_kwargs is not None:
+            compile_forward(self, compile_kwargs)
+
     def forward(self, x):
         x = x.view(x.size(0), -1)
         x = torch.relu(self.l1(x))
@@ -55,11 +63,23 @@ class MNISTModel(L.LightningModule):
     def test_step(self, batch, batch_idx: int) -> STEP_OUTPUT | None:
         return self.shared_step(batch, "test")
 
+    def predict_step(self, batch, batch_idx: int) -> dict[str, torch.Tensor]:
+        x = batch[0] if isinstance(batch, list | tuple) else batch
+        probs = torch.softmax(self.forward(x), dim=1)
+
+        return {"preds": torch.argmax(probs, dim=1), "probs": probs}
+
     def configure_optimizers(self):
         return torch.optim.Adam(params=self.parameters(), lr=self.hparams.learning_rate)
 
     def configure_callbacks(self):
         callbacks_kargs = {"monitor": "val/acc", "mode": "max"}
-        early_stopping = EarlyStopping(patience=5, **callbacks_kargs)
-        model_checkpoint = ModelCheckpoint(**callbacks_kargs)
-        return [early_stopping, model_checkpoint]
+        callbacks = [EarlyStopping(patience=5, **callbacks_kargs)]
+        # a `ModelCheckpoint` replaces those of the trainer, only Lightning's default
+        # one (of the last epoch) is, not a configured one, e.g., `AsyncCheckpoint`
+        if all(
+            type(x) is ModelCheckpoint and x.monitor is None
+            for x in self.trainer.checkpoint_callbacks
+        ):
+            callbacks.append(ModelCheckpoint(**callbacks_kargs))
+        return callbacks
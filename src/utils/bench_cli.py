@@ -0,0 +1,105 @@
+import itertools
+import json
+import shlex
+import subprocess
+from pathlib import Path
+from typing import Any
+
+import yaml
+from jsonargparse import CLI
+
+
+def next_version_dir(save_dir: Path) -> Path:
+    versions = [
+        int(d.name.split("_")[1])
+        for d in save_dir.glob("version_*")
+        if d.is_dir() and d.name.split("_")[1].isdigit()
+    ]
+    return save_dir / f"version_{max(versions, default=-1) + 1}"
+
+
+def bench(
+    configs: list[str],
+    override_kwargs: dict[str, Any] | None = None,
+    num_steps: int = 50,
+    warmup_steps: int = 5,
+    save_dir: str = "results/bench",
+    check: bool = True,
+) -> list[Path]:
+    r"""
+    Benchmark every combination of ``configs`` and ``override_kwargs`` on CPU.
+
+    Each point runs ``./run fit`` in its own process for ``warmup_steps +
+    num_steps`` training steps with the ``Benchmark`` callback, which writes
+    ``bench.json`` next to the ``config.yaml`` of the run under ``save_dir``.
+    Returns the log directories of the points.
+
+    With ``check``, a failing point raises. Otherwise its ``bench.json`` holds
+    the ``returncode`` only, e.g., of points killed for running out of memory.
+    """
+    override_kwargs = {
+        k: v if isinstance(v, list) else [v] for k, v in (override_kwargs or {}).items()
+    }
+    callbacks = [
+        {
+            "class_path": "Benchmark",
+            "init_args": {
+                "warmup_steps": warmup_steps,
+                "num_loader_batches": num_steps,
+            },
+        }
+    ]
+
+    log_dirs = []
+    for config, values in itertools.product(
+        configs, itertools.product(*override_kwargs.values())
+    ):
+        overrides = dict(zip(override_kwargs.keys(), values, strict=True))
+        log_dir = next_version_dir(Path(save_dir))
+        log_dir.mkdir(parents=True)
+        log_dirs.append(log_dir)
+        # `fast_dev_run` skips saving the config, record the benchmark point instead
+        with (log_dir / "config.yaml").open("w") as f:
+            yaml.safe_dump({"config": config, **overrides}, f, sort_keys=False)
+
+        argv = ["./run", "fit", "--config", config]
+        argv.extend(
+            itertools.chain(
+                *[
+                    [f"--{k}", v if isinstance(v, str) else json.dumps(v)]
+                    for k, v in overrides.items()
+                ]
+            )
+        )
+        argv.extend(
+            [
+                "--trainer.accelerator",
+                "cpu",
+                "--trainer.devices",
+                "1",
+                "--trainer.fast_dev_run",
+                str(warmup_steps + num_steps),
+                "--trainer.default_root_dir",
+                str(log_dir),
+                "--trainer.callbacks",
+                json.dumps(callbacks),
+            ]
+        )
+
+        print(shlex.join(argv))
+        returncode = subprocess.run(argv, stdout=subprocess.DEVNULL).returncode
+        if returncode and check:
+            raise subprocess.CalledProcessError(returncode, argv)
+        if returncode:
+            with (log_dir / "bench.json").open("w") as f:
+                json.dump({"returncode": returncode}, f)
+
+    return log_dirs
+
+
+def bench_cli():
+    CLI(bench)
+
+
+if __name__ == "__main__":
+    bench_cli()
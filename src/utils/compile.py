@@ -0,0 +1,39 @@
+import os
+import sys
+from pathlib import Path
+from typing import Any
+
+import torch
+from torch import nn
+
+# keep compiled artifacts across runs and sweep trials instead of in /tmp
+CACHE_DIR = Path.home() / ".cache" / "torchinductor"
+
+
+def compile_forward(module: nn.Module, compile_kwargs: dict[str, Any]) -> None:
+    r"""
+    Compile ``module.forward`` in place with ``torch.compile(**compile_kwargs)``.
+
+    Unlike ``torch.compile(module)``, parameter names and checkpoints are
+    unchanged. The inductor caches go to ``TORCHINDUCTOR_CACHE_DIR`` if set, to
+    ``~/.cache/torchinductor`` otherwise.
+    """
+    from torch._inductor.runtime.cache_dir_utils import default_cache_dir
+
+    # torch fills in its default on import, so only replace that one
+    cache_dir = os.environ.get("TORCHINDUCTOR_CACHE_DIR", default_cache_dir())
+    if os.path.abspath(cache_dir) == os.path.abspath(default_cache_dir()):
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(CACHE_DIR)
+    module.forward = torch.compile(module.forward, **compile_kwargs)
+
+
+def compile_time() -> float:
+    r"""Return the seconds spent compiling in this process so far."""
+    if "torch._dynamo" not in sys.modules:
+        return 0.0
+
+    from torch._dynamo.utils import compilation_time_metrics
+
+    # backward graphs are compiled lazily on the first backward
+    keys = ["_compile.compile_inner", "compile_fx.<locals>.bw_compiler"]
+    return sum(sum(compilation_time_metrics.get(k, [])) for k in keys)
@@ -0,0 +1,199 @@
+import copy
+import importlib.util
+import json
+import time
+import warnings
+from pathlib import Path
+from typing import Literal
+
+import numpy as np
+import torch
+from jsonargparse import CLI
+from torch import nn
+
+from ..callbacks.async_checkpoint import SAFETENSORS_EXTENSION
+from ..datamodules import GLUEDataModule
+from ..models import GLUETransformer
+from ..models.glue_transformer import load_tokenizer
+from .inference import InferenceRunner
+
+
+class _Classifier(nn.Module):
+    # positional inputs and logits only, for tracing and ONNX export
+    def __init__(self, model: nn.Module, input_names: list[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        inputs = dict(zip(self.input_names, inputs, strict=True))
+        return self.model(**inputs, return_dict=False)[0]
+
+
+def load_texts(task_name: str, num_samples: int) -> list:
+    from datasets import load_dataset
+
+    datasets = load_dataset("glue", task_name)
+    split = next(x for x in datasets if "validation" in x)
+    dataset = datasets[split].select(range(min(num_samples, len(datasets[split]))))
+    text_fields = GLUEDataModule.task_text_field_map[task_name]
+
+    return GLUEDataModule._preprocess(dataset[:], text_fields)["text"]
+
+
+def measure(runner: InferenceRunner, texts: list, batch_size: int) -> dict:
+    runner.max_batch_size = batch_size
+    runner.logits(texts[:batch_size])  # warmup
+
+    latencies = []
+    for i in range(0, len(texts), batch_size):
+        start = time.perf_counter()
+        runner.logits(texts[i : i + batch_size])
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "latency_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "latency_p90_ms": float(np.percentile(latencies, 90) * 1000),
+        "throughput": len(texts) / sum(latencies),
+    }
+
+
+def export(
+    ckpt_path: str,
+    output_dir: str,
+    format: Literal["torchscript", "onnx"] = "torchscript",
+    quantize: bool = False,
+    num_samples: int = 256,
+    batch_sizes: list[int] | None = None,
+    min_agreement: float = 0.99,
+):
+    r"""
+    Export a ``GLUETransformer`` checkpoint to a self-contained CPU inference
+    artifact in ``output_dir`` and report its parity and speed.
+
+    The artifact holds the TorchScript or ONNX model returning logits, the
+    tokenizer and ``export.json``, and is loaded by
+    ``InferenceRunner.from_artifact``. With ``quantize``, the linear layers are
+    dynamically quantized to int8 (ONNX export and quantization require
+    ``onnx`` and ``onnxruntime``). LoRA adapters are merged into the backbone.
+    ``ckpt_path`` must be a full Lightning checkpoint, weights-only safetensors of
+    ``AsyncCheckpoint`` lack the hyperparameters to rebuild the model.
+
+    The exported and the fp32 eager model predict ``num_samples`` validation
+    examples, the agreement of their predictions and the maximum absolute
+    difference of their logits as well as latencies and throughputs at
+    ``batch_sizes`` are saved to ``report.json``. Raises if the agreement is
+    below ``min_agreement``.
+    """
+    if ckpt_path.endswith(SAFETENSORS_EXTENSION):
+        raise ValueError(
+            f"{ckpt_path} holds weights only, export a full `.ckpt` checkpoint, e.g.,"
+            " the `save_last` one of `AsyncCheckpoint`."
+        )
+    if format == "onnx":
+        # checked before the model is loaded and the examples are downloaded
+        missing = [
+            x for x in ["onnx", "onnxruntime"] if not importlib.util.find_spec(x)
+        ]
+        if missing:
+            raise ImportError(
+                f"ONNX export requires {' and '.join(missing)}, install them with"
+                f" `pip install {' '.join(missing)}`."
+            )
+    batch_sizes = batch_sizes or [1, 32]
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    module = GLUETransformer.load_from_checkpoint(ckpt_path, map_location="cpu")
+    module.eval()
+    # fold LoRA adapters into the backbone weights
+    module.merge_adapters()
+    tokenizer = load_tokenizer(module.hparams.model_name_or_path)
+    input_names = list(tokenizer.model_input_names)
+    max_length = module.hparams.max_length
+    classifier = _Classifier(module.model, input_names).eval()
+
+    texts = load_texts(module.hparams.task_name, num_samples)
+    # pad the example so that tracing keeps the attention mask
+    example = tokenizer(
+        texts[:2], padding="longest", truncation=True, max_length=max_length
+    )
+    example = tuple(torch.tensor(example[k]) for k in input_names)
+
+    model_file = "model.onnx" if format == "onnx" else "model.pt"
+    model_path = output_dir / model_file
+    with torch.inference_mode(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", (FutureWarning, torch.jit.TracerWarning))
+        if format == "onnx":
+            # quantization needs the fp32 graph as a separate file
+            fp32_path = model_path.with_suffix(".fp32.onnx") if quantize else model_path
+            torch.onnx.export(
+                classifier,
+                example,
+                fp32_path,
+                input_names=input_names,
+                output_names=["logits"],
+                dynamic_axes={k: {0: "batch", 1: "sequence"} for k in input_names},
+                dynamo=False,
+            )
+            if quantize:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+
+                quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+                fp32_path.unlink()
+        else:
+            exported = classifier
+            if quantize:
+                exported = torch.ao.quantization.quantize_dynamic(
+                    copy.deepcopy(classifier), {nn.Linear}, dtype=torch.qint8
+                )
+            torch.jit.trace(exported, example, strict=False).save(model_path)
+
+    tokenizer.save_pretrained(output_dir)
+    meta = {
+        "format": format,
+        "model_file": model_file,
+        "quantize": quantize,
+        "input_names": input_names,
+        "max_length": max_length,
+        "task_name": module.hparams.task_name,
+        "num_labels": module.hparams.num_labels,
+    }
+    with (output_dir / "export.json").open("w") as f:
+        json.dump(meta, f, indent=2)
+
+    eager = InferenceRunner(classifier, tokenizer, input_names, max_length)
+    runner = InferenceRunner.from_artifact(output_dir)
+    eager_logits, logits = eager.logits(texts), runner.logits(texts)
+    if module.hparams.num_labels > 1:
+        agreement = (eager_logits.argmax(-1) == logits.argmax(-1)).float().mean()
+    else:
+        agreement = torch.isclose(eager_logits, logits, atol=1e-2).float().mean()
+
+    report = {
+        "agreement": agreement.item(),
+        "max_abs_diff": (eager_logits - logits).abs().max().item(),
+        "eager": {bs: measure(eager, texts, bs) for bs in batch_sizes},
+        format: {bs: measure(runner, texts, bs) for bs in batch_sizes},
+    }
+    report["speedup"] = {
+        bs: report[format][bs]["throughput"] / report["eager"][bs]["throughput"]
+        for bs in batch_sizes
+    }
+    report_str = json.dumps(report, indent=2)
+    (output_dir / "report.json").write_text(report_str)
+    print(report_str)
+
+    if report["agreement"] < min_agreement:
+        raise ValueError(
+            f"Agreement with the eager model {report['agreement']:.4f} is below "
+            f"{min_agreement}."
+        )
+
+
+def export_cli():
+    CLI(export)
+
+
+if __name__ == "__main__":
+    export_cli()
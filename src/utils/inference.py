@@ -0,0 +1,176 @@
+import json
+import queue
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+from pathlib import Path
+
+import torch
+
+
+class InferenceRunner:
+    r"""
+    Batched CPU inference for sequence classification.
+
+    ``predict`` sorts the inputs by length and pads each micro-batch of
+    ``max_batch_size`` inputs to its longest sequence. ``submit`` queues a single
+    input and returns a future, a background thread groups the queued inputs into
+    micro-batches of up to ``max_batch_size`` inputs, waiting at most
+    ``max_wait_ms`` for a batch to fill.
+
+    Inputs are texts or pairs of texts, outputs are dicts with the predicted
+    ``preds`` and the class ``probs`` (only ``preds`` for regression), like
+    ``GLUETransformer.predict_step``.
+
+    Args:
+        model: Callable mapping the tokenized inputs to logits.
+        tokenizer: Tokenizer of the model.
+        input_names: Names of the tokenized inputs, in the order of ``model``.
+        max_length: Maximum sequence length.
+        max_batch_size: Maximum size of a micro-batch.
+        max_wait_ms: Maximum time to wait for a micro-batch to fill in ``submit``.
+    """
+
+    def __init__(
+        self,
+        model: Callable[..., torch.Tensor],
+        tokenizer,
+        input_names: Sequence[str],
+        max_length: int | None = None,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.input_names = list(input_names)
+        self.max_length = max_length
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._worker = None
+
+    @classmethod
+    def from_artifact(cls, artifact_dir: str, **kwargs) -> "InferenceRunner":
+        r"""Load an artifact saved by ``export_cli``."""
+        from transformers import AutoTokenizer
+
+        artifact_dir = Path(artifact_dir)
+        meta = json.loads((artifact_dir / "export.json").read_text())
+        model_path = artifact_dir / meta["model_file"]
+
+        if meta["format"] == "onnx":
+            import onnxruntime as ort
+
+            session = ort.InferenceSession(
+                str(model_path), providers=["CPUExecutionProvider"]
+            )
+
+            def model(*inputs):
+                feeds = {
+                    k: v.numpy()
+                    for k, v in zip(meta["input_names"], inputs, strict=True)
+                }
+                return torch.from_numpy(session.run(None, feeds)[0])
+
+        else:
+            model = torch.jit.load(model_path, map_location="cpu")
+            model.eval()
+
+        return cls(
+            model,
+            AutoTokenizer.from_pretrained(artifact_dir),
+            meta["input_names"],
+            max_length=meta["max_length"],
+            **kwargs,
+        )
+
+    @torch.inference_mode()
+    def logits(self, texts: Sequence) -> torch.Tensor:
+        r"""Compute the logits of ``texts`` in micro-batches, in input order."""
+        features = self.tokenizer(
+            list(texts), truncation=True, max_length=self.max_length
+        )
+        lengths = [len(x) for x in features["input_ids"]]
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+
+        logits = [None] * len(order)
+        for i in range(0, len(order), self.max_batch_size):
+            indices = order[i : i + self.max_batch_size]
+            batch = self.tokenizer.pad(
+                {k: [features[k][j] for j in indices] for k in self.input_names},
+                return_tensors="pt",
+            )
+            outputs = self.model(*(batch[k] for k in self.input_names))
+            for j, x in zip(indices, outputs, strict=True):
+                logits[j] = x
+
+        return torch.stack(logits) if logits else torch.empty(0)
+
+    def predict(self, texts: Sequence) -> list[dict]:
+        return self._postprocess(self.logits(texts))
+
+    def submit(self, text) -> Future:
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._serve, daemon=True)
+            self._worker.start()
+
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def close(self) -> None:
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+    def __enter__(self) -> "InferenceRunner":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _serve(self) -> None:
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(
+                        timeout=max(deadline - time.perf_counter(), 0)
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            texts, futures = zip(*batch, strict=True)
+            try:
+                outputs = self.predict(texts)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, output in zip(futures, outputs, strict=True):
+                    future.set_result(output)
+
+    @staticmethod
+    def _postprocess(logits: torch.Tensor) -> list[dict]:
+        if logits.size(-1) == 1:
+            return [{"preds": x} for x in logits.squeeze(-1).tolist()]
+        probs = torch.softmax(logits, dim=-1)
+        preds = torch.argmax(probs, dim=-1)
+
+        return [
+            {"preds": x, "probs": y}
+            for x, y in zip(preds.tolist(), probs.tolist(), strict=True)
+        ]
@@ -1,12 +1,47 @@
+import importlib
 import os
+import re
+import sys
 from collections.abc import Iterable
 
-from lightning.pytorch.cli import LightningArgumentParser, LightningCLI
+from lightning.pytorch.cli import ArgsType, LightningArgumentParser, LightningCLI
+
+
+def _import_short_names(texts: Iterable[str]) -> None:
+    # jsonargparse resolves a short class name, e.g., `--model MNISTModel`, only
+    # among the subclasses imported already, so the lazily imported models and
+    # datamodules that the arguments or config files name are imported first
+    text = "\n".join(texts)
+    for package in ["src.models", "src.datamodules"]:
+        module = importlib.import_module(package)
+        for name in module.__all__:
+            if re.search(rf"\b{name}\b", text):
+                getattr(module, name)
 
 
 class LitCLI(LightningCLI):
+    def parse_arguments(self, parser: LightningArgumentParser, args: ArgsType) -> None:
+        if args is None or isinstance(args, list):
+            texts = [
+                *(args if args is not None else sys.argv[1:]),
+                *(
+                    path
+                    for kwargs in self.parser_kwargs.values()
+                    if isinstance(kwargs, dict)
+                    for path in kwargs.get("default_config_files", [])
+                ),
+            ]
+            # the contents of config files given as arguments, e.g., `--config`
+            for arg in list(texts):
+                path = arg.split("=", 1)[-1]
+                if os.path.isfile(path):
+                    with open(path) as f:
+                        texts.append(f.read())
+            _import_short_names(texts)
+        super().parse_arguments(parser, args)
+
     def add_arguments_to_parser(self, parser: LightningArgumentParser) -> None:
-        for arg in ["num_labels", "task_name"]:
+        for arg in ["num_labels", "task_name", "task_names"]:
             parser.link_arguments(
                 f"data.init_args.{arg}",
                 f"model.init_args.{arg}",
@@ -26,16 +61,50 @@ class LitCLI(LightningCLI):
                 )
 
 
-def lit_cli():
-    LitCLI(
-        parser_kwargs={
+class _ParseOnlyCLI(LitCLI):
+    # stops before instantiating the classes and running the subcommand, and leaves
+    # the global seed and `seed_everything` as they are
+    def _set_seed(self) -> None:
+        pass
+
+    def instantiate_classes(self) -> None:
+        pass
+
+    def after_instantiate_classes(self) -> None:
+        pass
+
+    def _run_subcommand(self, subcommand: str) -> None:
+        pass
+
+
+def _cli_kwargs() -> dict:
+    return {
+        "parser_kwargs": {
             cmd: {
                 "default_config_files": ["configs/presets/default.yaml"],
             }
-            for cmd in ["fit", "validate", "test"]
+            for cmd in ["fit", "validate", "test", "predict"]
         },
-        save_config_kwargs={"overwrite": True},
-    )
+        "save_config_kwargs": {"overwrite": True},
+    }
+
+
+def lit_cli(args: list[str] | None = None):
+    LitCLI(args=args, **_cli_kwargs())
+
+
+def resolve_config(args: list[str]) -> dict:
+    r"""
+    Config of the subcommand in ``args`` as ``lit_cli`` would run it, with the
+    presets, config files and overrides merged, without instantiating anything or
+    seeding, i.e., ``seed_everything: true`` stays ``True``.
+    """
+    cli = _ParseOnlyCLI(args=args, **_cli_kwargs())
+    config = cli.config[cli.subcommand].clone()
+    # merged already
+    config.pop("config", None)
+
+    return config.as_dict()
 
 
 if __name__ == "__main__":
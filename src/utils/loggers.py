@@ -1,8 +1,17 @@
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
 
 import lightning as L
+import torch
+from lightning.fabric.utilities.logger import _add_prefix
 from lightning.fabric.utilities.types import _PATH
 from lightning.pytorch.callbacks import ModelCheckpoint
+from lightning.pytorch.loggers import CSVLogger
+from lightning.pytorch.trainer.connectors.logger_connector.logger_connector import (
+    _LoggerConnector,
+)
+from lightning.pytorch.utilities import rank_zero_only
 
 
 # TODO:
@@ -40,3 +49,159 @@ def __resolve_ckpt_dir(self, trainer: L.Trainer) -> _PATH:
 
 
 ModelCheckpoint._ModelCheckpoint__resolve_ckpt_dir = __resolve_ckpt_dir
+
+
+class ParquetLogger(CSVLogger):
+    r"""
+    Log metrics to the ``metrics.parquet`` dataset in ``log_dir``, like
+    ``CSVLogger`` does to ``metrics.csv``.
+
+    Logged tensors are buffered as they are, without syncing the device, and
+    every ``flush_logs_every_n_steps`` calls of ``log_metrics`` they are copied
+    and appended as a row group of ``step``, ``name`` and ``value`` columns on a
+    background thread. Every trainer run writes its own part file, appended to
+    and never rewritten, which is complete once the logger is finalized at the
+    end of the run. ``pandas.read_parquet`` reads the parts as one table.
+
+    Args:
+        save_dir: Save directory.
+        name: Experiment name.
+        version: Experiment version, defaults to the next available one.
+        prefix: A string to put at the beginning of metric keys.
+        flush_logs_every_n_steps: Number of ``log_metrics`` calls per row group.
+    """
+
+    NAME_METRICS_FILE = "metrics.parquet"
+
+    def __init__(
+        self,
+        save_dir: _PATH,
+        name: str | None = "lightning_logs",
+        version: int | str | None = None,
+        prefix: str = "",
+        flush_logs_every_n_steps: int = 100,
+    ):
+        super().__init__(
+            save_dir,
+            name=name,
+            version=version,
+            prefix=prefix,
+            flush_logs_every_n_steps=flush_logs_every_n_steps,
+        )
+        self._buffer = []
+        self._num_logged = 0
+        self._executor = None
+        self._future = None
+        self._writer = None
+
+    @rank_zero_only
+    def log_metrics(self, metrics: dict[str, Any], step: int | None = None) -> None:
+        metrics = _add_prefix(metrics, self._prefix, self.LOGGER_JOIN_CHAR)
+        if step is None:
+            step = self._num_logged
+        self._num_logged += 1
+        # step values are copies already (`_ResultMetric` clones them)
+        self._buffer.append((step, metrics))
+        if len(self._buffer) >= self._flush_logs_every_n_steps:
+            self._flush()
+
+    @rank_zero_only
+    def save(self) -> None:
+        # called after every `log_metrics`, the buffer is flushed when full instead
+        pass
+
+    @rank_zero_only
+    def finalize(self, status: str) -> None:
+        self._flush()
+        if self._future is not None:
+            self._future.result()
+            self._future = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._fs.makedirs(self.log_dir, exist_ok=True)
+        buffer, self._buffer = self._buffer, []
+        previous = self._future
+        self._future = self._executor.submit(self._write, buffer, previous)
+
+    def _write(self, buffer: list, previous: Future | None) -> None:
+        # device to host copies only block this thread
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if previous is not None:
+            # raise the errors of previous writes
+            previous.result()
+
+        steps, names, values = [], [], []
+        for step, metrics in buffer:
+            steps.extend([step] * len(metrics))
+            names.extend(metrics)
+            values.extend(metrics.values())
+
+        # one copy for all tensors
+        indices = [i for i, v in enumerate(values) if isinstance(v, torch.Tensor)]
+        if indices:
+            device = values[indices[0]].device
+            tensors = torch.stack(
+                [values[i].to(device, torch.float64).reshape(()) for i in indices]
+            )
+            for i, v in zip(indices, tensors.tolist(), strict=True):
+                values[i] = v
+        table = pa.table(
+            {
+                "step": pa.array(steps, pa.int64()),
+                "name": pa.array(names, pa.string()),
+                "value": pa.array(values, pa.float64()),
+            }
+        )
+        if self._writer is None:
+            # a part per run, nested runs (e.g., the validation and test of
+            # `Metric`) and resumed ones finalize the previous parts
+            dirpath = os.path.join(self.log_dir, self.NAME_METRICS_FILE)
+            os.makedirs(dirpath, exist_ok=True)
+            part = sum(x.endswith(".parquet") for x in os.listdir(dirpath))
+            path = os.path.join(dirpath, f"part-{part:04d}.parquet")
+            self._writer = pq.ParquetWriter(path, table.schema)
+        self._writer.write_table(table)
+
+
+def __log_metrics(self, metrics: dict[str, Any], step: int | None = None) -> None:
+    """Logs the metric dict passed in, as ``_LoggerConnector.log_metrics`` but
+    without converting tensors to scalars when only ``ParquetLogger``s log, so
+    that logging does not sync the device."""
+    loggers = self.trainer.loggers
+    if not loggers or not all(isinstance(x, ParquetLogger) for x in loggers):
+        return __log_metrics_to_scalars(self, metrics, step)
+    if not metrics:
+        return
+
+    self._logged_metrics.update(metrics)
+
+    metrics = dict(metrics)
+    if step is None:
+        step_metric = metrics.pop("step", None)
+        if step_metric is not None:
+            step = int(step_metric)
+        else:
+            # added metrics for convenience
+            metrics.setdefault("epoch", self.trainer.current_epoch)
+            step = self.trainer.fit_loop.epoch_loop._batches_that_stepped
+
+    for logger in loggers:
+        logger.log_metrics(metrics=metrics, step=step)
+        logger.save()
+
+
+__log_metrics_to_scalars = _LoggerConnector.log_metrics
+_LoggerConnector.log_metrics = __log_metrics
@@ -0,0 +1,150 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import yaml
+from jsonargparse import CLI
+
+from .bench_cli import bench
+
+# technique: (config key, off, on)
+TECHNIQUES = {
+    "gradient_checkpointing": ("model.gradient_checkpointing", False, True),
+    "bf16_autocast": ("trainer.precision", "32-true", "bf16-mixed"),
+    "factored_optimizer": ("model.optimizer", "adamw", "adafactor"),
+}
+
+
+def to_config(overrides: dict[str, Any]) -> dict:
+    config = {}
+    for k, v in overrides.items():
+        *keys, last = k.split(".")
+        node = config
+        for key in keys:
+            node = node.setdefault(key, {})
+            # model and data are subclass configs
+            if key in ["model", "data"]:
+                node = node.setdefault("init_args", {})
+        node[last] = v
+
+    return config
+
+
+def plan(
+    config_path: str,
+    memory_budget_mb: float,
+    techniques: list[str] | None = None,
+    override_kwargs: dict[str, Any] | None = None,
+    num_steps: int = 20,
+    warmup_steps: int = 3,
+    save_dir: str = "results/memory",
+):
+    r"""
+    Choose the fastest combination of memory saving ``techniques`` whose peak
+    memory stays within ``memory_budget_mb`` for ``config_path`` on CPU.
+
+    Every combination of ``techniques`` (all of ``TECHNIQUES`` by default), and
+    of ``override_kwargs``, e.g., larger batch sizes, is benchmarked with
+    ``bench`` in its own process, and its peak resident memory and step
+    throughput are compared. Failed points, e.g., killed for running out of
+    memory, are over budget. ``memory.json`` in ``save_dir`` holds the runs, the
+    memory saved and throughput kept by each technique on its own, and the
+    selection, which is also saved as ``memory_budget.yaml`` to append after
+    ``config_path``. Raises if no combination fits.
+    """
+    techniques = techniques or list(TECHNIQUES)
+    override_kwargs = {
+        k: v if isinstance(v, list) else [v] for k, v in (override_kwargs or {}).items()
+    }
+    grid = {TECHNIQUES[x][0]: list(TECHNIQUES[x][1:]) for x in techniques}
+    log_dirs = bench(
+        [config_path],
+        override_kwargs={**grid, **override_kwargs},
+        num_steps=num_steps,
+        warmup_steps=warmup_steps,
+        save_dir=save_dir,
+        # points over the physical memory are killed, they are over budget
+        check=False,
+    )
+
+    runs = []
+    for log_dir in log_dirs:
+        with (log_dir / "config.yaml").open() as f:
+            overrides = yaml.safe_load(f)
+        overrides.pop("config")
+        with (log_dir / "bench.json").open() as f:
+            metrics = json.load(f)
+        runs.append(
+            {
+                "techniques": [
+                    x
+                    for x in techniques
+                    if overrides[TECHNIQUES[x][0]] == TECHNIQUES[x][2]
+                ],
+                "overrides": overrides,
+                # `None` for failed points
+                "peak_rss_mb": metrics.get("peak_rss_mb"),
+                "step_throughput": metrics.get("step_throughput"),
+                **(
+                    {"returncode": metrics["returncode"]}
+                    if "returncode" in metrics
+                    else {}
+                ),
+            }
+        )
+
+    # each technique on its own against the same point without any
+    def point(run):
+        return {k: v for k, v in run["overrides"].items() if k not in grid}
+
+    completed = [x for x in runs if x["peak_rss_mb"] is not None]
+    baselines = [x for x in completed if not x["techniques"]]
+    costs = {}
+    for run in completed:
+        if len(run["techniques"]) != 1:
+            continue
+        baseline = next((x for x in baselines if point(x) == point(run)), None)
+        if baseline is None:
+            # failed, or excluded from `techniques`
+            continue
+        costs.setdefault(run["techniques"][0], []).append(
+            {
+                **point(run),
+                "memory_saved_mb": baseline["peak_rss_mb"] - run["peak_rss_mb"],
+                "throughput_ratio": run["step_throughput"]
+                / baseline["step_throughput"],
+            }
+        )
+
+    fits = [x for x in completed if x["peak_rss_mb"] <= memory_budget_mb]
+    if not fits:
+        if not completed:
+            raise ValueError("Every combination failed, e.g., ran out of memory.")
+        lowest = min(x["peak_rss_mb"] for x in completed)
+        raise ValueError(
+            f"No combination fits the memory budget of {memory_budget_mb:.0f} MB,"
+            f" the lowest peak memory is {lowest:.0f} MB."
+        )
+    selected = max(fits, key=lambda x: x["step_throughput"])
+
+    save_dir = Path(save_dir)
+    report = {
+        "config": config_path,
+        "memory_budget_mb": memory_budget_mb,
+        "runs": runs,
+        "techniques": costs,
+        "selected": selected,
+    }
+    report_str = json.dumps(report, indent=2)
+    (save_dir / "memory.json").write_text(report_str)
+    with (save_dir / "memory_budget.yaml").open("w") as f:
+        yaml.safe_dump(to_config(selected["overrides"]), f, sort_keys=False)
+    print(report_str)
+
+
+def memory_cli():
+    CLI(plan)
+
+
+if __name__ == "__main__":
+    memory_cli()
@@ -0,0 +1,269 @@
+import itertools
+import json
+import os
+import re
+import time
+import tracemalloc
+from pathlib import Path
+
+import torch
+from lightning.pytorch.profilers import Profiler
+
+# hooks after which allocations are attributed, where datasets are materialized and
+# evaluation outputs are gathered and released
+SNAPSHOT_ACTIONS = [
+    r"\[LightningDataModule\].*\.setup",
+    r"\[LightningModule\].*\.on_(train|validation|test)_epoch_end",
+    r"\[Callback\]Metric\.teardown",
+]
+
+
+def resident_memory() -> tuple[float, float]:
+    # current and peak resident memory in MB, the peak since the last reset
+    rss = hwm = 0.0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith("VmHWM:"):
+                hwm = int(line.split()[1]) / 1024
+    return rss, hwm
+
+
+def reset_peak_memory() -> bool:
+    # resets the peak resident memory, and the global CUDA peak statistics once CUDA
+    # is initialized, False if the peak cannot be reset
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.reset_peak_memory_stats()
+    return True
+
+
+class MemoryProfiler(Profiler):
+    r"""
+    Record resident (and CUDA) memory around every action Lightning profiles, e.g.,
+    ``[LightningDataModule]GLUEDataModule.setup``, ``train_dataloader_next``,
+    ``training_step`` and ``[Callback]Metric.teardown``, which includes the
+    validation and test after fitting.
+
+    Each action is written to ``memory-timeline.jsonl`` in the log dir (with the
+    local rank on several devices) with its memory at the end, its change and
+    its peak. Peaks are exact on Linux, where the peak of the process is reset
+    after every action and folded into the enclosing ones. The summary ranks the
+    actions by their largest growth.
+
+    Once CUDA is initialized, its peak statistics are reset after every action
+    too, so ``torch.cuda.max_memory_allocated`` in user code or other callbacks
+    (e.g., ``LoaderTuner``) reads the peak of the current action only while this
+    profiler runs.
+
+    With ``trace_allocations``, Python allocations are traced with ``tracemalloc``
+    and snapshotted after ``snapshot_actions``. Those events hold the ``top_k``
+    source lines by memory retained since the previous snapshot, and the summary
+    those since the first one. Tensor storage is not allocated by Python and
+    only shows in resident memory, the objects holding it (e.g., lists of
+    outputs, Arrow tables) do show.
+
+    Tracing slows Python allocations down severalfold, for diagnosis only.
+
+    Args:
+        dirpath: Directory of the timeline and summary, the log dir by default.
+        filename: Prefix of the timeline and summary files.
+        trace_allocations: Trace Python allocations with ``tracemalloc``.
+        num_frames: Number of frames of the traced allocations.
+        top_k: Number of source lines per snapshot.
+        snapshot_actions: Regular expressions of the actions after which to
+            snapshot, ``SNAPSHOT_ACTIONS`` by default.
+    """
+
+    def __init__(
+        self,
+        dirpath: str | Path | None = None,
+        filename: str = "memory",
+        trace_allocations: bool = True,
+        num_frames: int = 1,
+        top_k: int = 10,
+        snapshot_actions: list[str] | None = None,
+    ):
+        super().__init__(dirpath=dirpath, filename=filename)
+        self.trace_allocations = trace_allocations
+        self.num_frames = num_frames
+        self.top_k = top_k
+        self.snapshot_actions = re.compile(
+            "|".join(snapshot_actions or SNAPSHOT_ACTIONS)
+        )
+
+        self._current_actions = {}
+        self._stats = {}
+        self._stages = []
+        self._timeline = None
+        self._start_time = time.monotonic()
+        self._resettable = True
+        self._tracing = False
+        self._first_snapshot = None
+        self._last_snapshot = None
+
+    def setup(
+        self, stage: str, local_rank: int | None = None, log_dir: str | None = None
+    ) -> None:
+        # trainer runs nest, e.g., the validation and test in `Metric.teardown`
+        self._stages.append(stage)
+        super().setup(stage, local_rank, log_dir)
+        if self._timeline is None:
+            dirpath = self.dirpath or "."
+            os.makedirs(dirpath, exist_ok=True)
+            rank = "" if self._local_rank is None else f"-{self._local_rank}"
+            filepath = Path(dirpath) / f"{self.filename}-timeline{rank}.jsonl"
+            self._timeline = filepath.open("a")
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(self.num_frames)
+            self._tracing = True
+        self._resettable = reset_peak_memory()
+
+    def start(self, action_name: str) -> None:
+        memory = self._sample()
+        # a stack per action, nested runs call the same hooks, e.g., `Metric.teardown`
+        self._current_actions.setdefault(action_name, []).append(
+            {
+                **memory,
+                "peak_rss_mb": memory["rss_mb"],
+                "peak_cuda_mb": memory.get("cuda_mb"),
+            }
+        )
+
+    def stop(self, action_name: str) -> None:
+        if not self._current_actions.get(action_name):
+            raise ValueError(
+                f"Attempting to stop recording an action ({action_name}) which was"
+                " never started."
+            )
+        memory = self._sample()
+        start = self._current_actions[action_name].pop()
+
+        event = {
+            "time": time.monotonic() - self._start_time,
+            "stage": self._stage,
+            "action": action_name,
+            "rss_mb": memory["rss_mb"],
+            "delta_rss_mb": memory["rss_mb"] - start["rss_mb"],
+            "peak_rss_mb": start["peak_rss_mb"],
+        }
+        if "cuda_mb" in memory:
+            event["cuda_mb"] = memory["cuda_mb"]
+            event["peak_cuda_mb"] = start["peak_cuda_mb"]
+
+        stats = self._stats.setdefault(
+            action_name,
+            {"calls": 0, "delta_rss_mb": 0.0, "max_delta_rss_mb": -float("inf")},
+        )
+        stats["calls"] += 1
+        stats["delta_rss_mb"] += event["delta_rss_mb"]
+        stats["max_delta_rss_mb"] = max(
+            stats["max_delta_rss_mb"], event["delta_rss_mb"]
+        )
+        stats["peak_rss_mb"] = max(stats.get("peak_rss_mb", 0.0), event["peak_rss_mb"])
+        stats["rss_mb"] = event["rss_mb"]
+
+        if tracemalloc.is_tracing() and self.snapshot_actions.fullmatch(action_name):
+            event["hot_spots"] = self._snapshot()
+            # not attributed to the enclosing actions
+            reset_peak_memory()
+
+        if self._timeline is not None:
+            self._timeline.write(json.dumps(event) + "\n")
+
+    def summary(self) -> str:
+        lines = [
+            f"{'Action':<80}{'Calls':>8}{'Mean Δ MB':>12}{'Max Δ MB':>12}"
+            f"{'Peak MB':>12}{'Last MB':>12}"
+        ]
+        for action, stats in sorted(
+            self._stats.items(), key=lambda x: x[1]["max_delta_rss_mb"], reverse=True
+        ):
+            lines.append(
+                f"{action[:79]:<80}{stats['calls']:>8}"
+                f"{stats['delta_rss_mb'] / stats['calls']:>12.1f}"
+                f"{stats['max_delta_rss_mb']:>12.1f}"
+                f"{stats['peak_rss_mb']:>12.1f}{stats['rss_mb']:>12.1f}"
+            )
+        if self._first_snapshot is not None:
+            lines.append("")
+            lines.append("Python allocations retained since the first snapshot:")
+            for x in self._hot_spots(self._last_snapshot, self._first_snapshot):
+                lines.append(
+                    f"{x['size_diff_mb']:>+10.1f} MB {x['count_diff']:>+10} blocks"
+                    f"  {x['line']}"
+                )
+
+        return self._stats_to_str({"memory": os.linesep.join(lines)})
+
+    def teardown(self, stage: str | None) -> None:
+        super().teardown(stage)
+        if self._stages:
+            self._stages.pop()
+        # back in the enclosing run, if any
+        if self._stages:
+            self._stage = self._stages[-1]
+            return
+
+        if self._timeline is not None:
+            self._timeline.close()
+            self._timeline = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self._first_snapshot = self._last_snapshot = None
+
+    def _sample(self) -> dict[str, float]:
+        # the peaks since the previous sample belong to every open action
+        rss, hwm = resident_memory()
+        if not self._resettable:
+            hwm = rss
+        memory = {"rss_mb": rss}
+        cuda_peak = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            memory["cuda_mb"] = torch.cuda.memory_allocated() / 2**20
+            cuda_peak = torch.cuda.max_memory_allocated() / 2**20
+        for record in itertools.chain(*self._current_actions.values()):
+            record["peak_rss_mb"] = max(record["peak_rss_mb"], hwm)
+            if cuda_peak is not None:
+                record["peak_cuda_mb"] = max(record["peak_cuda_mb"] or 0.0, cuda_peak)
+        if self._resettable:
+            reset_peak_memory()
+
+        return memory
+
+    def _snapshot(self) -> list[dict]:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ]
+        )
+        hot_spots = self._hot_spots(snapshot, self._last_snapshot)
+        self._first_snapshot = self._first_snapshot or snapshot
+        self._last_snapshot = snapshot
+
+        return hot_spots
+
+    def _hot_spots(
+        self, snapshot: tracemalloc.Snapshot, previous: tracemalloc.Snapshot | None
+    ) -> list[dict]:
+        if previous is None:
+            stats = snapshot.statistics("lineno")
+        else:
+            stats = snapshot.compare_to(previous, "lineno")
+
+        return [
+            {
+                "line": f"{x.traceback[0].filename}:{x.traceback[0].lineno}",
+                "size_mb": x.size / 2**20,
+                "size_diff_mb": getattr(x, "size_diff", x.size) / 2**20,
+                "count_diff": getattr(x, "count_diff", x.count),
+            }
+            for x in stats[: self.top_k]
+        ]
@@ -1,9 +1,13 @@
+import gc
+import hashlib
 import itertools
 import json
 import math
 import os
 import shlex
 import subprocess
+import tempfile
+import time
 from pathlib import Path
 from typing import Any, Literal
 
@@ -13,8 +17,74 @@ from ray import train, tune
 
 ray.init(_temp_dir=str(Path.home() / ".cache" / "ray"))
 
+# results of finished trials by the hash of their resolved config
+RESULT_CACHE_DIR = Path("results/trials")
 
-def run_cli(config, debug: bool = True, command: str = "fit", devices: int = 1):
+SEARCH_SPACES = [
+    "uniform",
+    "quniform",
+    "loguniform",
+    "qloguniform",
+    "randn",
+    "randint",
+    "qrandint",
+    "lograndint",
+    "choice",
+    "grid_search",
+]
+
+
+def run_in_process(argv: list[str]):
+    # imported lazily to keep the subprocess mode driver light
+    import torch
+
+    from .lit_cli import lit_cli
+    from .trial_cache import enable_trial_cache
+
+    # keep tokenizers, pretrained weights and prepared datasets warm in the actor
+    enable_trial_cache()
+    try:
+        lit_cli(argv[1:])
+    finally:
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def run_in_subprocess(argv: list[str], report_file: Path):
+    # stream the metrics the `TuneReport` callback appends to Tune as they arrive
+    process = subprocess.Popen(argv, stdout=subprocess.DEVNULL)
+    try:
+        with report_file.open() as f:
+            line = ""
+            while True:
+                finished = process.poll() is not None
+                line += f.readline()
+                if line.endswith("\n"):
+                    train.report(json.loads(line))
+                    line = ""
+                elif finished:
+                    break
+                else:
+                    time.sleep(1)
+    finally:
+        # the scheduler stopped the trial if reporting raised
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, argv)
+
+
+def run_cli(
+    config,
+    debug: bool = True,
+    command: str = "fit",
+    devices: int = 1,
+    in_process: bool = False,
+    skip_finished: bool = True,
+):
     os.chdir(os.environ["TUNE_ORIG_WORKING_DIR"])
 
     argv = ["./run", command]
@@ -44,34 +114,134 @@ def run_cli(config, debug: bool = True, command: str = "fit", devices: int = 1):
         argv.extend(["--config", "configs/presets/tester.yaml"])
 
     print(shlex.join(argv))
-    subprocess.check_output(argv)
+    # imported lazily, as in `run_in_process`
+    from .lit_cli import resolve_config
+
+    # the same config after merging presets and overrides is the same trial, unless
+    # it draws a random seed
+    resolved_config = resolve_config(argv[1:])
+    cacheable = resolved_config.get("seed_everything") is not True
+    config_hash = hashlib.sha256(
+        json.dumps(resolved_config, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+    cache_file = RESULT_CACHE_DIR / f"{config_hash}.json"
+    if skip_finished and cacheable and cache_file.exists():
+        result = json.loads(cache_file.read_text())
+        print(f"Finished already in {result['log_dir']}, reporting its metrics again.")
+        # every validation, as the trial reported them, for schedulers to compare
+        for metrics in result["reports"]:
+            train.report(metrics)
+        return
+
+    tmp_dir = Path(tempfile.mkdtemp())
+    result_file = tmp_dir / "result.json"
+    argv.append("--trainer.callbacks+=TuneReport")
+    argv.append(f"--trainer.callbacks.result_file={result_file}")
+    if in_process:
+        run_in_process(argv)
+    else:
+        report_file = tmp_dir / "reports.jsonl"
+        report_file.touch()
+        argv.append(f"--trainer.callbacks.report_file={report_file}")
+        run_in_subprocess(argv, report_file)
+
+    # failed trials and those stopped by the scheduler raised above and are run
+    # again by the next sweep, trials that reported nothing are not cached
+    if cacheable and result_file.exists():
+        result = json.loads(result_file.read_text())
+        RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with cache_file.open("w") as f:
+            json.dump({"config": resolved_config, **result}, f, indent=2, default=str)
+
+
+def grid_axis(values: list) -> Any:
+    # a single value is a constant, which search algorithms other than grid search
+    # (e.g., Optuna) accept too
+    return values[0] if len(values) == 1 else tune.grid_search(values)
+
+
+def search_space(value: Any):
+    r"""
+    Lists are grid searched, ``{name: args}`` with ``name`` in ``SEARCH_SPACES``
+    is sampled with ``tune.<name>(*args)``, e.g., ``{loguniform: [1e-5, 1e-3]}``,
+    other values (and lists of one) are constants.
+    """
+    if isinstance(value, list):
+        return grid_axis(value)
+    if isinstance(value, dict) and len(value) == 1:
+        name, args = next(iter(value.items()))
+        if name == "choice":
+            # takes the list of categories itself
+            return tune.choice(args)
+        if name in SEARCH_SPACES:
+            return getattr(tune, name)(*(args if isinstance(args, list) else [args]))
+    return value
 
 
 def sweep(
     command: Literal["fit", "validate", "test"],
     debug: bool = False,
     gpus_per_trial: int | float = 1,
+    in_process: bool = False,
+    skip_finished: bool = True,
     *,
+    metric: str | None = None,
+    mode: Literal["min", "max"] = "max",
+    scheduler: Literal["fifo", "asha", "median"] = "fifo",
+    scheduler_kwargs: dict[str, Any] | None = None,
+    search_alg: Literal["random", "optuna"] = "random",
+    num_samples: int = 1,
+    max_concurrent_trials: int | None = None,
     ckpt_paths: list[str | None] | None = None,
     configs: list[str] | None = None,
     data_configs: list[str | None] | None = None,
     override_kwargs: dict[str, Any] | None = None,
 ):
     param_space = {
-        **({"ckpt_path": tune.grid_search(ckpt_paths)} if ckpt_paths else {}),
-        **({"config": tune.grid_search(configs)} if configs else {}),
-        **({"data_config": tune.grid_search(data_configs)} if data_configs else {}),
+        **({"ckpt_path": grid_axis(ckpt_paths)} if ckpt_paths else {}),
+        **({"config": grid_axis(configs)} if configs else {}),
+        **({"data_config": grid_axis(data_configs)} if data_configs else {}),
         **(
-            {
-                k: tune.grid_search(v) if isinstance(v, list) else tune.grid_search([v])
-                for k, v in override_kwargs.items()
-            }
+            {k: search_space(v) for k, v in override_kwargs.items()}
             if override_kwargs
             else {}
         ),
     }
+    grid_keys = [
+        k for k, v in param_space.items() if isinstance(v, dict) and "grid_search" in v
+    ]
+    if search_alg == "optuna" and grid_keys:
+        raise ValueError(
+            f"Optuna samples its search space and cannot grid search {grid_keys},"
+            " give them a single value or a distribution, e.g., `{choice: [...]}`."
+        )
 
-    tune_config = tune.TuneConfig()
+    # trials report every validation, `training_iteration` counts them
+    scheduler_kwargs = scheduler_kwargs or {}
+    if scheduler == "asha":
+        trial_scheduler = tune.schedulers.ASHAScheduler(**scheduler_kwargs)
+    elif scheduler == "median":
+        trial_scheduler = tune.schedulers.MedianStoppingRule(**scheduler_kwargs)
+    else:
+        trial_scheduler = tune.schedulers.FIFOScheduler()
+
+    if search_alg == "optuna":
+        from ray.tune.search.optuna import OptunaSearch
+
+        searcher = OptunaSearch()
+    else:
+        searcher = None
+
+    # in-process trials reuse actors so that imports and caches stay warm
+    tune_config = tune.TuneConfig(
+        metric=metric,
+        mode=mode if metric else None,
+        scheduler=trial_scheduler,
+        search_alg=searcher,
+        num_samples=num_samples,
+        max_concurrent_trials=max_concurrent_trials,
+        reuse_actors=in_process,
+    )
     run_config = train.RunConfig(
         log_to_file=True,
         storage_path=Path("./results/ray").resolve(),
@@ -81,6 +251,8 @@ def sweep(
         debug=debug,
         command=command,
         devices=math.ceil(gpus_per_trial),
+        in_process=in_process,
+        skip_finished=skip_finished,
     )
     tuner = tune.Tuner(
         tune.with_resources(trainable, resources={"gpu": gpus_per_trial}),
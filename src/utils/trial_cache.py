@@ -0,0 +1,54 @@
+import copy
+import functools
+from collections.abc import Callable
+from typing import Any
+
+_enabled = False
+# the last arguments and result of each function
+_cache: dict[Callable, tuple[tuple, Any]] = {}
+
+
+def enable_trial_cache() -> None:
+    r"""
+    Keep the results of :func:`cached` functions across trials run in the same
+    process, e.g., tokenizers, pretrained weights and prepared datasets in a
+    long-lived Ray actor. Disabled by default so single runs hold no extra copies.
+
+    Only the last result of each function is kept, so trials that share, e.g., a
+    pretrained model reuse it, and one with another model frees the previous one.
+    """
+    global _enabled
+    _enabled = True
+
+
+def clear_trial_cache() -> None:
+    _cache.clear()
+
+
+def cached(fn: Callable | None = None, *, copy_result: bool = False) -> Callable:
+    r"""
+    Memoize the last call of ``fn`` on its arguments while the trial cache is
+    enabled.
+
+    Args:
+        copy_result: Return a deep copy of the cached result, for mutable objects
+            such as models that each trial must own.
+    """
+    if fn is None:
+        return functools.partial(cached, copy_result=copy_result)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return fn(*args, **kwargs)
+
+        key = (args, tuple(sorted(kwargs.items())))
+        if fn not in _cache or _cache[fn][0] != key:
+            # drop the previous result before computing the next
+            _cache.pop(fn, None)
+            _cache[fn] = (key, fn(*args, **kwargs))
+        result = _cache[fn][1]
+
+        return copy.deepcopy(result) if copy_result else result
+
+    return wrapper
@@ -0,0 +1,41 @@
+import pytest
+
+from src.datamodules.glue_multitask_datamodule import _TaskBatchSampler
+
+
+def task_of(index: int, sizes: list[int]) -> int:
+    for task, size in enumerate(sizes):
+        if index < size:
+            return task
+        index -= size
+    raise IndexError(index)
+
+
+@pytest.mark.parametrize("num_replicas", [2, 3, 4])
+@pytest.mark.parametrize("sizes", [[65, 7], [65, 130, 5], [33, 97, 5]])
+def test_every_rank_gets_a_batch_of_the_same_task(sizes, num_replicas):
+    batch_size = 32
+    ranks = [
+        list(
+            _TaskBatchSampler(
+                sizes, batch_size, num_replicas=num_replicas, rank=rank, seed=1
+            )
+        )
+        for rank in range(num_replicas)
+    ]
+
+    num_batches = {len(x) for x in ranks}
+    assert len(num_batches) == 1
+    for batches in zip(*ranks, strict=True):
+        assert all(batches)
+        assert all(len(x) <= batch_size for x in batches)
+        tasks = {task_of(i, sizes) for x in batches for i in x}
+        assert len(tasks) == 1
+        # ranks share the global batch without overlap
+        indices = [i for x in batches for i in x]
+        assert len(indices) == len(set(indices))
+
+
+def test_tasks_smaller_than_the_number_of_ranks_are_rejected():
+    with pytest.raises(ValueError):
+        _TaskBatchSampler([65, 1], 32, num_replicas=2)